@@ -0,0 +1,99 @@
+import time
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+import tyro
+
+from engine import Advection, Flow, SolidsHandler, Workspace, advect
+from utils import make_solid_box
+
+
+@dataclass
+class Args:
+    """Compares the detail the advection schemes keep at different resolutions.
+
+    A slotted disk (Zalesak's test) is rotated once around the centre of the grid by a
+    rigid rotation, after which the exact solution is the initial disk again. The error
+    is the mean absolute difference to it, relative to the area of the disk, so it is
+    comparable between resolutions. Every size is the number of interior cells per side.
+    """
+
+    sizes: Tuple[int, ...] = (32, 48, 64, 96, 128, 192, 256)
+    steps: int = 600
+    single_precision: bool = False
+
+
+def slotted_disk(n: int, dtype) -> np.ndarray:
+    """Returns the padded n x n grid of the slotted disk, 1 inside and 0 outside."""
+    # cell centre coordinates in the unit square, the walls lie outside of it
+    c = (np.arange(n + 2) - 0.5) / n
+    y, x = c[:, None], c[None, :]
+    disk = (y - 0.25) ** 2 + (x - 0.5) ** 2 <= 0.15**2
+    slot = (np.abs(x - 0.5) <= 0.025) & (y >= 0.15)
+    grid = (disk & ~slot).astype(dtype)
+    grid[[0, -1], :] = 0
+    grid[:, [0, -1]] = 0
+    return grid
+
+
+def rotation(n: int, steps: int, dtype) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns u and v of a rigid rotation around the centre that turns once in steps
+    steps of dt = 1. advect moves a cell by dt * rows * (u, v) cells."""
+    rows = n + 2
+    omega = 2 * np.pi / steps  # radians per step
+    c = np.arange(rows) - (rows - 1) / 2
+    i, j = c[:, None], c[None, :]
+    u = np.ascontiguousarray(np.broadcast_to(-omega * j / rows, (rows, rows)), dtype=dtype)
+    v = np.ascontiguousarray(np.broadcast_to(omega * i / rows, (rows, rows)), dtype=dtype)
+    return u, v
+
+
+def run(n: int, steps: int, scheme: Advection, dtype) -> Tuple[float, float]:
+    """Returns the relative error after one revolution and the time of one step."""
+    initial = slotted_disk(n, dtype)
+    u, v = rotation(n, steps, dtype)
+    boundary = SolidsHandler(make_solid_box(initial.shape, dtype))
+    work = Workspace()
+    grid, spare = initial.copy(), np.empty_like(initial)
+
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        advect(grid, boundary, Flow.NONE, u, v, 1, spare, work, scheme)
+        grid, spare = spare, grid
+    elapsed = time.perf_counter() - t0
+
+    error = np.abs(grid - initial).sum() / initial.sum()
+    return float(error), elapsed / steps
+
+
+def main(args):
+    dtype = np.float32 if args.single_precision else np.float64
+    results = {}
+    print(f"{'scheme':<16}{'size':>6}{'error':>10}{'ms/step':>10}")
+    for scheme in Advection:
+        for n in args.sizes:
+            error, step_time = run(n, args.steps, scheme, dtype)
+            results[scheme, n] = error, step_time
+            print(f"{scheme.name:<16}{n:>6}{error:>10.4f}{step_time * 1000:>10.3f}")
+
+    print("\nsmallest MacCormack grid with at most the error of each semi-Lagrangian grid:")
+    for n in args.sizes:
+        error, step_time = results[Advection.SEMI_LAGRANGIAN, n]
+        matching = [
+            m for m in args.sizes if results[Advection.MACCORMACK, m][0] <= error
+        ]
+        if not matching:
+            print(f"  {n:>4}: none of the sizes")
+            continue
+        m = min(matching)
+        mc_time = results[Advection.MACCORMACK, m][1]
+        print(
+            f"  {n:>4}: {m:>4}, {(n / m) ** 2:.1f}x fewer cells, "
+            f"{step_time / mc_time:.1f}x faster per step"
+        )
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    main(args)
@@ -0,0 +1,224 @@
+import json
+import os
+import platform
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+import tyro
+
+from engine import Flow, FluidSimulation, advect, diffuse, project
+
+
+@dataclass
+class Args:
+    """Times the kernels of the solver and the drawer on a sweep of grid sizes, dtypes
+    and test scenarios, and compares the times to a saved baseline.
+
+    Every size is the number of interior cells per side of a square grid. Each case is
+    run `repeats` times after `warmup` untimed runs, and its median is reported. With
+    --save the results are written to the baseline file, otherwise they are compared to
+    it and the run fails when a case got slower than the baseline by more than
+    `threshold` (0.25 is 25%). The comparison uses the fastest run of each case, which
+    is less affected by other load on the machine than the median.
+    """
+
+    kernels: Tuple[str, ...] = (
+        "diffuse",
+        "advect",
+        "project",
+        "apply",
+        "build_cache",
+        "vel_step",
+        "dense_step",
+        "draw_grid",
+        "draw_velocity_field",
+    )
+    test_scenarios: Tuple[int, ...] = (1, 5)
+    sizes: Tuple[int, ...] = (64, 128, 256)
+    dtypes: Tuple[str, ...] = ("float64", "float32")
+    diff: float = 1e-5
+    visc: float = 1e-4
+    repeats: int = 20
+    warmup: int = 3
+    # steps run before timing, so that the fields are not empty
+    settle_steps: int = 10
+    seed: int = 0
+    cell_size: int = 4  # window pixels per cell of the drawer cases
+    baseline: str = "benchmark.json"
+    save: bool = False
+    threshold: float = 0.25
+
+
+def kernel_case(
+    name: str, sim: FluidSimulation, cell_size: int
+) -> Tuple[Callable, Optional[Callable]]:
+    """Returns the function that runs the kernel once on the fields of sim, and the
+    function that restores its inputs before every run, if it changes them."""
+    dt = 1.0
+    grid, u, v = sim.grid.copy(), sim.u.copy(), sim.v.copy()
+    out = np.empty_like(grid)
+
+    if name == "diffuse":
+        return (
+            lambda: diffuse(
+                u, sim.solids, Flow.VERTICAL, sim.visc, dt, sim.diffuse_solver, out,
+                sim.work,
+            ),
+            None,
+        )
+    if name == "advect":
+        return (
+            lambda: advect(
+                grid, sim.solids, Flow.NONE, u, v, dt, out, sim.work, sim.advection
+            ),
+            None,
+        )
+    if name == "project":
+        pu, pv = np.empty_like(u), np.empty_like(v)
+
+        def reset():
+            np.copyto(pu, u)
+            np.copyto(pv, v)
+
+        return lambda: project(pu, pv, sim.solids, sim.pressure_solver, sim.work), reset
+    if name == "apply":
+        return lambda: sim.solids.apply(out, Flow.VERTICAL), lambda: np.copyto(out, u)
+    if name == "build_cache":
+        return sim.solids._build_cache, None
+    if name == "vel_step":
+        return lambda: sim.vel_step(dt), None
+    if name == "dense_step":
+        return lambda: sim.dense_step(dt), None
+    if name in ("draw_grid", "draw_velocity_field"):
+        # only imported for the drawer cases, which render to a hidden window
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        import pygame as pg
+
+        from drawer import GridDrawer
+
+        rows, cols = grid.shape
+        pg.display.init()
+        pg.display.set_mode(((cols - 2) * cell_size, (rows - 2) * cell_size))
+        drawer = GridDrawer(rows, cols, cell_size)
+        if name == "draw_grid":
+            # draw_grid clips the grid in place
+            return lambda: drawer.draw_grid(out), lambda: np.copyto(out, grid)
+        return lambda: drawer.draw_velocity_field(u, v), None
+    raise Exception(f"Benchmark: Invalid kernel '{name}'")
+
+
+def measure(
+    run: Callable, reset: Optional[Callable], repeats: int, warmup: int
+) -> np.ndarray:
+    """Returns the seconds of every timed run."""
+    times = np.empty(repeats)
+    for k in range(warmup + repeats):
+        if reset is not None:
+            reset()
+        t0 = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - t0
+        if k >= warmup:
+            times[k - warmup] = elapsed
+    return times
+
+
+def run_benchmarks(args) -> Dict[str, dict]:
+    """Returns the results of every case, keyed by kernel/scenario/size/dtype."""
+    results = {}
+    for scenario in args.test_scenarios:
+        for dtype in args.dtypes:
+            for n in args.sizes:
+                for name in args.kernels:
+                    # every case starts from the same state, some scenarios use noise
+                    np.random.seed(args.seed)
+                    sim = FluidSimulation.from_scenario(
+                        scenario, n + 2, n + 2, dtype=dtype, diff=args.diff, visc=args.visc
+                    )
+                    for _ in range(args.settle_steps):
+                        sim.step(1.0)
+                    run, reset = kernel_case(name, sim, args.cell_size)
+                    times = measure(run, reset, args.repeats, args.warmup)
+                    key = f"{name}/scenario{scenario}/{n}/{dtype}"
+                    results[key] = {
+                        "median": float(np.median(times)),
+                        "min": float(times.min()),
+                        "cells": n * n,
+                    }
+                    print(f"{key:<40}{results[key]['median'] * 1e3:>10.3f} ms")
+    return results
+
+
+def print_scaling(results: Dict[str, dict]) -> None:
+    """Prints the nanoseconds per cell of every kernel over the grid sizes."""
+    curves: Dict[str, Dict[int, float]] = {}
+    for key, result in results.items():
+        name, scenario, n, dtype = key.split("/")
+        curve = curves.setdefault(f"{name}/{scenario}/{dtype}", {})
+        curve[int(n)] = result["median"] / result["cells"] * 1e9
+    sizes = sorted({n for curve in curves.values() for n in curve})
+
+    print(f"\n{'ns per cell':<40}" + "".join(f"{n:>10}" for n in sizes))
+    for case, curve in curves.items():
+        values = (curve.get(n, float("nan")) for n in sizes)
+        print(f"{case:<40}" + "".join(f"{value:>10.2f}" for value in values))
+
+
+def compare(
+    results: Dict[str, dict], baseline: Dict[str, dict], threshold: float
+) -> list:
+    """Returns the keys of the cases that are slower than the baseline by more than
+    threshold, by their fastest runs. Cases missing from either side are not compared."""
+    regressions = []
+    print(f"\n{'compared to the baseline':<40}{'baseline':>10}{'now':>10}{'change':>10}")
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before, now = baseline[key]["min"], result["min"]
+        change = now / before - 1
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{key:<40}{before * 1e3:>10.3f}{now * 1e3:>10.3f}{change:>+10.1%}{flag}")
+        if change > threshold:
+            regressions.append(key)
+    return regressions
+
+
+def main(args):
+    results = run_benchmarks(args)
+    print_scaling(results)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "machine": {
+                        "platform": platform.platform(),
+                        "processor": platform.processor(),
+                        "python": platform.python_version(),
+                        "numpy": np.__version__,
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"\nbaseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nno baseline at {args.baseline}, save one with --save")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} cases regressed by more than {args.threshold:.0%}")
+        raise SystemExit(1)
+    print("\nno regressions")
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    main(args)
@@ -0,0 +1,217 @@
+"""Saves the full state of a FluidSimulation to disk and restores it.
+
+A checkpoint is a directory with one .npy file per field and a meta.json of the
+parameters:
+
+    <path>/meta.json     version, step count and the parameters of the simulation
+    <path>/grid.npy      density
+    <path>/u.npy         velocities
+    <path>/v.npy
+    <path>/source.npy    sources
+    <path>/u_source.npy
+    <path>/v_source.npy
+    <path>/solids.npy    solid cells, 1 is solid
+
+The files are opened with np.load(mmap_mode=...) when restoring, so a restore only maps
+them and the pages are read when the simulation first touches them. Writes go to a
+temporary directory first that replaces the old checkpoint when it is complete, so a
+crash while writing leaves the previous checkpoint intact. The old checkpoint is moved
+to <path>.old for the moment until the new one takes its place, restoring falls back to
+it when a crash left no checkpoint at <path>.
+"""
+
+import dataclasses
+import json
+import os
+import shutil
+import threading
+from typing import Optional
+
+import numpy as np
+
+from engine import Advection, Backend, FluidSimulation, Solver, SolverOptions
+
+VERSION = 1
+FIELDS = ("grid", "u", "v", "source", "u_source", "v_source")
+
+
+def _parameter(value):
+    """Returns value in a form json can write, per member parameters become lists."""
+    return np.asarray(value).tolist() if isinstance(value, np.ndarray) else value
+
+
+def _solver_options(options: SolverOptions) -> dict:
+    fields = [f.name for f in dataclasses.fields(options) if f.init]
+    values = {name: getattr(options, name) for name in fields}
+    values["solver"] = options.solver.name
+    return values
+
+
+def state_of(sim: FluidSimulation, steps: int = 0) -> dict:
+    """Returns copies of the arrays of a checkpoint of sim, and its meta data under
+    "meta"."""
+    arrays = {name: getattr(sim, name).copy() for name in FIELDS}
+    arrays["solids"] = sim.solids.bound.copy()
+    arrays["meta"] = {
+        "version": VERSION,
+        "steps": steps,
+        "dtype": str(sim.grid.dtype),
+        "shape": list(sim.grid.shape),
+        "diff": _parameter(sim.diff),
+        "visc": _parameter(sim.visc),
+        "diffuse_solver": _solver_options(sim.diffuse_solver),
+        "pressure_solver": _solver_options(sim.pressure_solver),
+        "backend": sim.backend.name,
+        "workers": sim.bands.workers,
+        "sequential_advection": sim.sequential_advection,
+        "advection": sim.advection.name,
+    }
+    return arrays
+
+
+def write_state(state: dict, path: str) -> None:
+    """Writes the state returned by state_of to the checkpoint directory path."""
+    path = os.path.normpath(path)
+    tmp, old = f"{path}.tmp", f"{path}.old"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, values in state.items():
+        if name != "meta":
+            np.save(os.path.join(tmp, f"{name}.npy"), values)
+    # written last, a directory without it is not a checkpoint
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(state["meta"], f, indent=2)
+
+    if os.path.exists(path):
+        # without path, old is the last complete checkpoint, keep it until tmp took over
+        shutil.rmtree(old, ignore_errors=True)
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def _complete(path: str) -> str:
+    """Returns the directory of the checkpoint path, which is path.old when a crash
+    between moving the old checkpoint away and the new one in left only that one."""
+    path = os.path.normpath(path)
+    old = f"{path}.old"
+    if not os.path.exists(os.path.join(path, "meta.json")) and os.path.exists(
+        os.path.join(old, "meta.json")
+    ):
+        return old
+    return path
+
+
+def save_checkpoint(sim: FluidSimulation, path: str, steps: int = 0) -> None:
+    """Writes a checkpoint of sim to the directory path, replacing an older one."""
+    write_state(state_of(sim, steps), path)
+
+
+def read_meta(path: str) -> dict:
+    path = _complete(path)
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("version") != VERSION:
+        raise ValueError(
+            f"Checkpoint {path} has version {meta.get('version')}, this version reads "
+            f"version {VERSION}"
+        )
+    return meta
+
+
+def load_checkpoint(
+    path: str, mmap_mode: Optional[str] = "c", **kwargs
+) -> FluidSimulation:
+    """Returns the simulation saved in the checkpoint directory path.
+
+    The fields are memory-mapped with mmap_mode. The default "c" is copy on write, the
+    simulation can change its fields without touching the files. With None they are
+    read into memory. The keyword arguments override the saved constructor arguments,
+    e.g. backend or workers.
+    """
+    path = _complete(path)
+    meta = read_meta(path)
+    arrays = {
+        name: np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode))
+        for name in FIELDS + ("solids",)
+    }
+
+    def solver_options(options: dict) -> SolverOptions:
+        return SolverOptions(**{**options, "solver": Solver[options["solver"]]})
+
+    def parameter(value):
+        if isinstance(value, list):  # per member
+            return np.asarray(value, dtype=meta["dtype"])
+        return value
+
+    parameters = {
+        "diff": parameter(meta["diff"]),
+        "visc": parameter(meta["visc"]),
+        "diffuse_solver": solver_options(meta["diffuse_solver"]),
+        "pressure_solver": solver_options(meta["pressure_solver"]),
+        "backend": Backend[meta["backend"]],
+        "workers": meta["workers"],
+        "sequential_advection": meta["sequential_advection"],
+        "advection": Advection[meta["advection"]],
+    }
+    sim = FluidSimulation(
+        arrays["grid"],
+        arrays["source"],
+        arrays["u_source"],
+        arrays["v_source"],
+        arrays["solids"],
+        **{**parameters, **kwargs},
+    )
+    sim.u, sim.v = arrays["u"], arrays["v"]
+    return sim
+
+
+class CheckpointWriter:
+    """Writes checkpoints on a background thread.
+
+    `save` only copies the arrays, which takes about as long as a single add_source,
+    and hands them to the writer thread. While a checkpoint is still being written
+    further saves are skipped instead of waiting for it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.saved = 0
+        self.skipped = 0
+        self.error: Optional[BaseException] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def busy(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def save(self, sim: FluidSimulation, steps: int = 0) -> bool:
+        """Starts writing a checkpoint of sim, returns False if it was skipped. Raises
+        the error the last write failed with."""
+        self._raise()
+        if self.busy():
+            self.skipped += 1
+            return False
+        state = state_of(sim, steps)
+        self._thread = threading.Thread(
+            target=self._write, args=(state,), name="checkpoint", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def wait(self) -> None:
+        """Waits until the checkpoint being written is complete, raises the error it
+        failed with."""
+        if self._thread is not None:
+            self._thread.join()
+        self._raise()
+
+    def _raise(self) -> None:
+        if self.error is not None:
+            raise RuntimeError(f"Writing the checkpoint {self.path} failed") from self.error
+
+    def _write(self, state: dict) -> None:
+        try:
+            write_state(state, self.path)
+            self.saved += 1
+        except BaseException as e:
+            self.error = e
@@ -0,0 +1,69 @@
+from typing import Annotated, Literal
+import pygame as pg
+import numpy as np
+from numpy.typing import NDArray
+import matplotlib.pyplot as plt
+
+from utils import density_lut, density_pixels
+
+
+class GridDrawer:
+    """
+    grid drawer class that contains:
+      - Precomputed hsl -> rgb table with precision of 0.1
+      - Precomputed uint8 colormap table for the velocity magnitudes
+      - Surface of the grid interior, one pixel per cell, scaled up to the window
+    """
+
+    # the density colors of utils.density_lut, under the drawer's public name
+    hsl_to_rgb_table = density_lut
+
+    def __init__(self, grid_height: int, grid_width: int, cell_width: int):
+        self.grid_height = grid_height
+        self.grid_width = grid_width
+        self.cell_width = cell_width
+        vel_cmap = plt.get_cmap("RdBu")
+        self.vel_lut = (vel_cmap(np.arange(vel_cmap.N))[:, :3] * 255).astype(np.uint8)
+        self.screen = pg.display.get_surface()
+        # packed 0xRRGGBB pixels, the same layout as the values of hsl_to_rgb_table
+        self.surface = pg.Surface(
+            (grid_width - 2, grid_height - 2),
+            depth=32,
+            masks=(0xFF0000, 0x00FF00, 0x0000FF, 0),
+        )
+        self.scaled_size = (
+            (grid_width - 2) * cell_width,
+            (grid_height - 2) * cell_width,
+        )
+
+    def draw_grid(self, grid: Annotated[NDArray[np.int8], Literal[2]]) -> None:
+        np.clip(grid, 0, 255, out=grid)  # inplace
+        self._blit_interior(self.grid_pixels(grid))
+
+    def grid_pixels(self, grid: np.ndarray) -> np.ndarray:
+        """Returns the packed 0xRRGGBB image of the density, see utils.density_pixels."""
+        return density_pixels(grid)
+
+    def _blit_interior(self, pixels: np.ndarray) -> None:
+        """Blits an image of the grid interior (one pixel per cell) to the screen,
+        scaled up by the cell width."""
+        # surfarray indexes pixels as [x, y]
+        pg.surfarray.blit_array(self.surface, pixels.swapaxes(0, 1))
+        self.screen.blit(pg.transform.scale(self.surface, self.scaled_size), (0, 0))
+
+    def draw_velocity_field(
+        self,
+        u: Annotated[NDArray[np.int8], Literal[2]],
+        v: Annotated[NDArray[np.int8], Literal[2]],
+    ) -> None:
+        self._blit_interior(self.velocity_pixels(u, v))
+
+    def velocity_pixels(self, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        """Returns the (h, w, 3) RGB image of the velocity magnitude, one pixel per
+        interior cell."""
+        # the colormap is only sampled in [0, 1], larger magnitudes saturate at its last color
+        n = len(self.vel_lut)
+        vals = u[1:-1, 1:-1] * u[1:-1, 1:-1] + v[1:-1, 1:-1] * v[1:-1, 1:-1]
+        vals *= 10000 * n
+        np.minimum(vals, n - 1, out=vals)
+        return self.vel_lut[vals.astype(np.intp)]
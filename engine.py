@@ -1,73 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import Tuple, Annotated, Literal
-import pygame as pg
+from typing import Callable, Iterator, Optional, Sequence, Tuple
+import math
+import time
+import warnings
 import numpy as np
-from numpy.typing import NDArray
-import matplotlib.pyplot as plt
-from enum import Enum
-
-from utils import hsl_to_rgb, fill_circle, int_to_rgb
 
-
-class GridDrawer:
-    """
-    grid drawer class that contains:
-      - Precomputed hsl -> rgb table with precision of 0.1
-      - Precomputed cells to be colored individually
-    """
-
-    hsl_to_rgb_table = [hsl_to_rgb(180, 61, l / 10) for l in range(1001)]
-
-    def __init__(self, grid_height: int, grid_width: int, cell_width: int):
-        self.grid_height = grid_height
-        self.grid_width = grid_width
-        self.cell_width = cell_width
-        self.cells = self._make_cells()
-        self.vel_cmap = plt.get_cmap("RdBu")
-        self.screen = pg.display.get_surface()
-
-    def _make_cells(self) -> np.ndarray:
-        ret = np.empty(shape=(self.grid_height, self.grid_width), dtype=pg.Rect)
-        for y in range(self.grid_height):
-            for x in range(self.grid_width):
-                cell = pg.Rect(
-                    (x - 1) * self.cell_width,
-                    (y - 1) * self.cell_width,
-                    self.cell_width,
-                    self.cell_width,
-                )
-                ret[y, x] = cell
-        return ret
-
-    def draw_grid(self, grid: Annotated[NDArray[np.int8], Literal[2]]) -> None:
-        np.clip(grid, 0, 255, out=grid)  # inplace
-        l = (grid / 255) * 1000
-
-        # keep in mind that the first and last rows and columns are boundaries, so they dont need to be drawn
-        for y in range(1, self.grid_height - 1):
-            for x in range(1, self.grid_width - 1):
-                color = self.hsl_to_rgb_table[
-                    int(l[y, x])
-                ]  # TODO: consider proper rounding
-                pg.draw.rect(self.screen, int_to_rgb(color), self.cells[y, x])
-
-    def draw_velocity_field(
-        self,
-        u: Annotated[NDArray[np.int8], Literal[2]],
-        v: Annotated[NDArray[np.int8], Literal[2]],
-    ) -> None:
-        grid = u * u + v * v
-        grid_height, grid_width = grid.shape
-
-        y, x = np.mgrid[1 : grid_height - 1, 1 : grid_width - 1]
-        vals = 10000 * grid[1:-1, 1:-1]
-        colors = self.vel_cmap(vals)
-        colors_rgb = (colors[:, :, :3] * 255).astype(int)
-
-        for y in range(1, grid_height - 1):
-            for x in range(1, grid_width - 1):
-                c_rgb = tuple(colors_rgb[y - 1, x - 1])
-                pg.draw.rect(self.screen, c_rgb, self.cells[y, x])
+import utils
+from profiling import span
+from utils import fill_circle
 
 
 class Dir(Enum):
@@ -83,175 +26,1200 @@ class Flow(Enum):
     HORIZONTAL = 2
 
 
+class Solver(Enum):
+    JACOBI = 0
+    MULTIGRID = 1
+    CG = 2
+    SOR = 3
+
+
+class Backend(Enum):
+    NUMPY = 0
+    NUMBA = 1
+
+
+class Advection(Enum):
+    SEMI_LAGRANGIAN = 0
+    MACCORMACK = 1
+
+
+@dataclass
+class SolverOptions:
+    """Selects and configures the linear solver of diffuse and project.
+
+    tol is the relative residual at which CG and multigrid stop early (0 never stops early),
+    max_iter caps the Jacobi and SOR sweeps and the CG iterations, cycles caps the multigrid
+    V-cycles. omega is the over-relaxation factor of SOR, 1 is plain Gauss-Seidel.
+    With spectral set, domains whose only solids are the outer box are solved exactly
+    with an FFT instead, any other domain still uses solver.
+    """
+
+    solver: Solver = Solver.JACOBI
+    tol: float = 0.0
+    max_iter: int = 20
+    cycles: int = 2
+    omega: float = 1.0
+    spectral: bool = False
+    iterations: int = field(default=0, init=False)  # used by the most recent solve
+
+    def uses_jacobi(self, boundary) -> bool:
+        """True if the fixed Jacobi sweeps are run on this domain."""
+        return self.solver == Solver.JACOBI and not (self.spectral and boundary.box_only)
+
+
+class Workspace:
+    """Named scratch arrays, allocated on first use and reused by every later call."""
+
+    def __init__(self):
+        self._arrays = {}
+
+    def get(self, name: str, shape: Tuple[int, ...], dtype=np.float64) -> np.ndarray:
+        arr = self._arrays.get(name)
+        if arr is None or arr.shape != shape or arr.dtype != dtype:
+            arr = np.empty(shape, dtype=dtype)
+            self._arrays[name] = arr
+        return arr
+
+
+class RowBands:
+    """Splits the interior rows of a grid into bands that are updated in parallel on a
+    thread pool. NumPy releases the GIL inside its ufunc loops, so the bands of a large grid
+    run on separate cores. Bands read their halo rows straight from the neighbouring bands,
+    which is safe as long as a single `run` only reads the array it is not writing."""
+
+    # below this many rows per band the thread handoff costs more than the band saves
+    min_band_rows = 64
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(workers) if workers > 1 else None
+
+    def run(self, fn: Callable[[int, int], None], rows: int) -> None:
+        """Calls fn(start, stop) for consecutive bands covering range(rows) and waits for
+        all of them."""
+        bands = min(self.workers, rows // self.min_band_rows)
+        if self._executor is None or bands <= 1:
+            fn(0, rows)
+            return
+        bounds = [rows * k // bands for k in range(bands + 1)]
+        # list() waits for every band and re-raises the first exception
+        list(self._executor.map(fn, bounds[:-1], bounds[1:]))
+
+    def close(self) -> None:
+        """Shuts the thread pool down, later runs update all rows on the calling thread."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
 class SolidsHandler:
     def __init__(self, bound: np.ndarray):
         self.bound = bound
         self._build_cache()
 
     def add_solid(self, i: int, j: int, size: int) -> None:
-        fill_circle(self.bound, i, j, size, 1, fade=False)
-        self._build_cache()
+        self._paint(i, j, size, 1)
 
     def erase_solid(self, i: int, j: int, size: int) -> None:
         # TODO: make permanent walls that can not be erased
-        fill_circle(self.bound, i, j, size, 0, fade=False)
-        self._build_cache()
+        self._paint(i, j, size, 0)
+
+    def _paint(self, i: int, j: int, size: int, val: int) -> None:
+        """Fills a disk of the bound with val, then updates the caches only around it."""
+        rows, cols = self.bound.shape
+        top, bottom = max(i - size, 0), min(i + size + 1, rows)
+        left, right = max(j - size, 0), min(j + size + 1, cols)
+        if top >= bottom or left >= right:
+            return
+
+        window = self.bound[top:bottom, left:right]
+        fill_circle(window, i - top, j - left, size, val, fade=False)
+        self._update_cache(top, bottom, left, right)
+
+    @property
+    def box_only(self) -> bool:
+        """True if the solids are exactly the walls of the outer box, see make_solid_box"""
+        if self._box_only is None:
+            self._box_only = bool(
+                self.mask[[0, -1], :].all()
+                and self.mask[:, [0, -1]].all()
+                and not self.mask[1:-1, 1:-1].any()
+            )
+        return self._box_only
+
+    # coarsening stops at a level this many cells wide when it would merge fluid cells
+    # that are not connected inside their 2x2 block, the coarsest level is solved exactly
+    coarsest_merge_size = 32
+
+    def multigrid_levels(self) -> list:
+        """Returns the coarse levels of the multigrid hierarchy of this domain, from the
+        first coarse level down to the coarsest, see MultigridLevel. Cached until the
+        bound changes."""
+        if self._levels is None:
+            levels = [MultigridLevel.fine(self.mask_neg)]
+            while min(levels[-1].n.shape) > 4:
+                level = levels[-1]
+                if max(level.n.shape) <= self.coarsest_merge_size and level.splits():
+                    break
+                levels.append(level.coarsen())
+            self._levels = levels[1:]
+        return self._levels
 
     def _build_cache(self):
-        self.mask = (self.bound != 0)
-        self.mask_neg = (self.mask == 0)
-
-        zero_mask = 1 - self.bound  # assumes that all elems either 0 or 1
-        padded = np.pad(zero_mask, pad_width=1, mode="constant", constant_values=0)
+        self.mask = np.empty(self.bound.shape, dtype=bool)
+        self.mask_neg = np.empty(self.bound.shape, dtype=bool)
+        self.cnt = np.empty_like(self.bound)
+        self.left = np.empty_like(self.bound)
+        self.right = np.empty_like(self.bound)
+        self.up = np.empty_like(self.bound)
+        self.down = np.empty_like(self.bound)
+        self._solid_idx = np.empty(0, dtype=np.intp)
+        self._neighbour_idx = np.empty((4, 0), dtype=np.intp)
+        self._neighbour_base_weights = np.empty((4, 0), dtype=self.bound.dtype)
+
+        rows, cols = self.bound.shape
+        self._update_cache(0, rows, 0, cols)
+
+    def _update_cache(self, top: int, bottom: int, left: int, right: int) -> None:
+        """Brings the caches up to date after the bound changed in [top:bottom, left:right].
+
+        The neighbour counts depend on the cells one step away, the direction coefficients
+        on the cells two steps away, so only a window with a two cell halo is recomputed.
+        """
+        rows, cols = self.bound.shape
+        self._levels = None
+        self._box_only = None
+
+        def halo(n: int) -> Tuple[int, int, int, int]:
+            return max(top - n, 0), min(bottom + n, rows), max(left - n, 0), min(right + n, cols)
+
+        t, b, l, r = top, bottom, left, right
+        self.mask[t:b, l:r] = self.bound[t:b, l:r] != 0
+        self.mask_neg[t:b, l:r] = self.mask[t:b, l:r] == 0
 
         # TODO: consider 8-neighbour solution
+        t, b, l, r = halo(1)
+        # assumes that all elems either 0 or 1, outside the grid counts as solid
+        zero_mask = 1 - SolidsHandler._block(self.bound, t, b, l, r, fill=1)
         cnt = (
-            padded[:-2, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:] + padded[2:, 1:-1]
+            zero_mask[:-2, 1:-1]
+            + zero_mask[1:-1, :-2]
+            + zero_mask[1:-1, 2:]
+            + zero_mask[2:, 1:-1]
         )
 
         # TODO: Handle elements with only solid neighbours
         #  (zeroing them out atm)
         cnt[cnt != 0] = 1 / cnt[cnt != 0]
-        cnt[self.mask == 0] = 0
+        cnt[self.mask[t:b, l:r] == 0] = 0
+        self.cnt[t:b, l:r] = cnt
+        self._update_gather(t, b, l, r)
+
+        # the coefficient of a fluid cell is the count of its neighbour in that direction
+        t, b, l, r = halo(2)
+        cnt = SolidsHandler._block(self.cnt, t, b, l, r, fill=0)
+        mask_neg = self.mask_neg[t:b, l:r]
+        self.left[t:b, l:r] = cnt[1:-1, 2:] * mask_neg
+        self.right[t:b, l:r] = cnt[1:-1, :-2] * mask_neg
+        self.up[t:b, l:r] = cnt[2:, 1:-1] * mask_neg
+        self.down[t:b, l:r] = cnt[:-2, 1:-1] * mask_neg
+
+    def _update_gather(self, top: int, bottom: int, left: int, right: int) -> None:
+        """Recomputes the gather entries of the solid cells in [top:bottom, left:right]: the
+        flat indices of their 4 neighbours and the weights these get in the cell's value,
+        one row per direction, so that apply only has to touch the solid cells and their
+        neighbours."""
+        rows, cols = self.bound.shape
+
+        old_y, old_x = np.divmod(self._solid_idx, cols)
+        keep = ~((top <= old_y) & (old_y < bottom) & (left <= old_x) & (old_x < right))
+
+        y, x = np.nonzero(self.mask[top:bottom, left:right])
+        y += top
+        x += left
+        solid = y * cols + x
+        fluid = self.mask_neg.ravel()
+        weight = self.cnt.ravel()[solid]
+
+        sources, weights = [], []
+        # same order as the terms of the sum: left, right, up and down neighbour
+        for has_neighbour, offset in (
+            (x > 0, -1),
+            (x < cols - 1, 1),
+            (y > 0, -cols),
+            (y < rows - 1, cols),
+        ):
+            # missing and solid neighbours point at the cell itself with zero weight
+            source = np.where(has_neighbour, solid + offset, solid)
+            sources.append(source)
+            weights.append(np.where(has_neighbour & fluid[source], weight, 0))
+
+        self._solid_idx = np.concatenate((self._solid_idx[keep], solid))
+        self._neighbour_idx = np.concatenate(
+            (self._neighbour_idx[:, keep], np.stack(sources)), axis=1
+        )
+        self._neighbour_base_weights = np.concatenate(
+            (self._neighbour_base_weights[:, keep], np.stack(weights)), axis=1
+        )
+
+        self._neighbour_weights = {}
+        for flow in Flow:
+            m_v, m_h = SolidsHandler.multipliers(flow)
+            signs = np.array([m_h, m_h, m_v, m_v], dtype=self.bound.dtype)[:, None]
+            self._neighbour_weights[flow] = self._neighbour_base_weights * signs
 
-        self.left = SolidsHandler.shift_and_mask(cnt, self.mask_neg, Dir.LEFT)
-        self.right = SolidsHandler.shift_and_mask(cnt, self.mask_neg, Dir.RIGHT)
-        self.up = SolidsHandler.shift_and_mask(cnt, self.mask_neg, Dir.UP)
-        self.down = SolidsHandler.shift_and_mask(cnt, self.mask_neg, Dir.DOWN)
+    @staticmethod
+    def _block(
+        arr: np.ndarray, top: int, bottom: int, left: int, right: int, fill: float
+    ) -> np.ndarray:
+        """Returns arr[top - 1 : bottom + 1, left - 1 : right + 1], filled with fill where
+        it reaches over the edges of arr."""
+        rows, cols = arr.shape
+        block = np.full((bottom - top + 2, right - left + 2), fill, dtype=arr.dtype)
+        t, b = max(top - 1, 0), min(bottom + 1, rows)
+        l, r = max(left - 1, 0), min(right + 1, cols)
+        block[t - top + 1 : b - top + 1, l - left + 1 : r - left + 1] = arr[t:b, l:r]
+        return block
+
+    def gather(self, flow: Flow) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the flat indices of the solid cells, the flat indices of their 4 neighbours
+        and the weights of the neighbours for the flow, as used by apply."""
+        return self._solid_idx, self._neighbour_idx, self._neighbour_weights[flow]
 
     def apply(self, grid: np.ndarray, flow: Flow) -> None:
+        """Sets every solid cell to the mean of its fluid neighbours, negated along the
+        direction of the flow, and zero if it has no fluid neighbours.
+        grid may also be a C contiguous stack of grids of shape (B, rows, cols)."""
+        with span("apply"):
+            if grid.ndim == 2:
+                values = np.take(grid, self._neighbour_idx) * self._neighbour_weights[flow]
+                np.put(grid, self._solid_idx, values.sum(axis=0))
+                return
+
+            flat = grid.reshape(grid.shape[0], -1)
+            weights = self._neighbour_weights[flow]
+            values = np.take(flat, self._neighbour_idx, axis=1) * weights
+            flat[:, self._solid_idx] = values.sum(axis=1)
+
+    def self_weight(self, flow: Flow) -> np.ndarray:
+        """Returns for every fluid cell the total weight its own value gets in its solid
+        neighbours, i.e. how much of the cell is reflected back by the walls."""
+        m_v, m_h = SolidsHandler.multipliers(flow)
+        return m_h * (self.left + self.right) + m_v * (self.up + self.down)
+
+    @staticmethod
+    def multipliers(flow: Flow) -> Tuple[int, int]:
+        """Returns the vertical and horizontal reflection signs of the flow."""
         m_v, m_h = 1, 1
         if flow == Flow.HORIZONTAL:
             m_h = -1
         if flow == Flow.VERTICAL:
             m_v = -1
+        return m_v, m_h
 
-        values_in_solids = (
-                m_h * SolidsHandler.shift(grid * self.left, Dir.RIGHT)
-                + m_h * SolidsHandler.shift(grid * self.right, Dir.LEFT)
-                + m_v * SolidsHandler.shift(grid * self.up, Dir.DOWN)
-                + m_v * SolidsHandler.shift(grid * self.down, Dir.UP)
-        )
 
-        grid[self.mask] = values_in_solids[self.mask]
+def _per_member(value, grid: np.ndarray):
+    """Reshapes a per member parameter of a stack of grids, e.g. one diff for each member,
+    so that it broadcasts against the (B, rows, cols) stack. Scalars are returned as is."""
+    if np.ndim(value) == 0:
+        return value
+    return np.asarray(value, dtype=grid.dtype).reshape((-1,) + (1,) * (grid.ndim - 1))
 
-    @staticmethod
-    def shift_and_mask(arr: np.ndarray, mask, dir: Dir) -> np.ndarray:
-        shifted = SolidsHandler.shift(arr, dir)
-        shifted *= mask
-        return shifted
 
-    @staticmethod
-    def shift(arr: np.ndarray, dir: Dir) -> np.ndarray:
-        shifted = np.zeros_like(arr)
-        if dir == Dir.LEFT:
-            shifted[:, :-1] = arr[:, 1:]
-        elif dir == Dir.RIGHT:
-            shifted[:, 1:] = arr[:, :-1]
-        elif dir == Dir.UP:
-            shifted[:-1, :] = arr[1:, :]
-        elif dir == Dir.DOWN:
-            shifted[1:, :] = arr[:-1, :]
-        else:
-            raise Exception(f"Dir: Invalid enum item '{dir}'")
-        return shifted
+def _member(value, k: int):
+    """Returns the k-th member's value of a parameter reshaped by _per_member."""
+    if np.ndim(value) == 0:
+        return value
+    return value.reshape(-1)[k]
 
 
-def add_source(grid: np.ndarray, source: np.ndarray, dt: float) -> None:
+def add_source(
+    grid: np.ndarray, source: np.ndarray, dt: float, work: Optional[Workspace] = None
+) -> None:
     """Returns a new modified grid, where the sources are added to each corresponding cells"""
     assert grid.shape == source.shape
-    grid += dt * source
+    work = work or Workspace()
+    scaled = np.multiply(
+        _per_member(dt, grid), source, out=work.get("source", grid.shape, grid.dtype)
+    )
+    grid += scaled
 
 
-def diffuse(grid: np.ndarray, boundary, b: Flow, diff: float, dt: float) -> np.ndarray:
-    """Returns a new modified grid, where each cell's value is diffused."""
-    new_grid = np.zeros_like(grid)
-    rows, cols = grid.shape
-    a = dt * diff * rows * cols
+def diffuse(
+    grid: np.ndarray,
+    boundary,
+    b: Flow,
+    diff: float,
+    dt: float,
+    solver: Optional[SolverOptions] = None,
+    out: Optional[np.ndarray] = None,
+    work: Optional[Workspace] = None,
+    bands: Optional[RowBands] = None,
+) -> np.ndarray:
+    """Returns a new modified grid, where each cell's value is diffused.
+    If out is given, the result is written into it (it must not be grid).
+    The Jacobi sweeps are split into the row bands of bands, if given.
+
+    grid may be a stack of B grids of shape (B, rows, cols) sharing the solids of boundary,
+    diff and dt may then be sequences with one value per member."""
+    solver = solver or SolverOptions()
+    work = work or Workspace()
+    bands = bands or RowBands()
+    new_grid = np.empty_like(grid) if out is None else out
+    rows, cols = grid.shape[-2:]
+    a = _per_member(dt, grid) * _per_member(diff, grid) * rows * cols
+
+    if not solver.uses_jacobi(boundary):
+        np.copyto(new_grid, grid)
+        solve(new_grid, grid, a, 1 + 4 * a, boundary, b, solver)
+        return new_grid
+
+    new_grid.fill(0)
+    tmp = work.get("diffuse", grid.shape[:-2] + (rows - 2, cols - 2), grid.dtype)
+
+    def sweep(start: int, stop: int) -> None:
+        # interior rows start..stop are rows start + 1..stop + 1 of the padded grid
+        t = tmp[..., start:stop, :]
+        # (grid + a * (up + down + left + right)) / (1 + 4 * a), without temporaries
+        np.add(
+            new_grid[..., start:stop, 1:-1], new_grid[..., start + 2 : stop + 2, 1:-1], out=t
+        )
+        t += new_grid[..., start + 1 : stop + 1, :-2]
+        t += new_grid[..., start + 1 : stop + 1, 2:]
+        t *= a
+        t += grid[..., start + 1 : stop + 1, 1:-1]
+        t /= 1 + 4 * a
 
-    up = new_grid[:-2, 1:-1]
-    down = new_grid[2:, 1:-1]
-    left = new_grid[1:-1, :-2]
-    right = new_grid[1:-1, 2:]
+    def store(start: int, stop: int) -> None:
+        new_grid[..., start + 1 : stop + 1, 1:-1] = tmp[..., start:stop, :]
 
-    for _ in range(20):
-        new_grid[1:-1, 1:-1] = (grid[1:-1, 1:-1] + a * (up + down + left + right)) / (
-            1 + 4 * a
-        )
+    for _ in range(solver.max_iter):
+        bands.run(sweep, rows - 2)
+        bands.run(store, rows - 2)
+    solver.iterations = solver.max_iter
 
     boundary.apply(new_grid, b)
     return new_grid
 
 
-def advect(
-    grid: np.ndarray, boundary, b: Flow, u: np.ndarray, v: np.ndarray, dt: float
-) -> np.ndarray:
-    """Returns a new modified grid, where the velocities, u and v, are applied to the grid cell values."""
-    new_grid = np.copy(grid)
-    rows, cols = grid.shape
-    dt0 = dt * rows
+@functools.lru_cache(maxsize=8)
+def _base_coordinates(rows: int, cols: int, dtype) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the row and column coordinates of the interior cells of a rows x cols grid,
+    shaped to broadcast against the interior. Cached per shape, so they are read only."""
+    i = np.arange(1, rows - 1, dtype=dtype)[:, None]
+    j = np.arange(1, cols - 1, dtype=dtype)[None, :]
+    i.flags.writeable = False
+    j.flags.writeable = False
+    return i, j
+
 
-    i, j = np.meshgrid(np.arange(1, rows - 1), np.arange(1, cols - 1), indexing="ij")
+@dataclass
+class Backtrace:
+    """The departure points of a semi-Lagrangian step, shared by every field advected by
+    the same velocities: the flat indices of the 4 corners each interior cell is
+    interpolated from, and the bilinear weights along the rows (s) and columns (t)."""
 
-    x = i - dt0 * u[1:-1, 1:-1]
-    y = j - dt0 * v[1:-1, 1:-1]
+    shape: Tuple[int, ...]
+    idx00: np.ndarray
+    idx01: np.ndarray
+    idx10: np.ndarray
+    idx11: np.ndarray
+    s0: np.ndarray
+    s1: np.ndarray
+    t0: np.ndarray
+    t1: np.ndarray
+
+
+def backtrace(
+    u: np.ndarray,
+    v: np.ndarray,
+    dt: float,
+    work: Optional[Workspace] = None,
+    name: str = "advect",
+) -> Backtrace:
+    """Traces every interior cell back along the velocities, u and v, for dt, a negative
+    dt traces forward. u and v may be stacks of shape (B, rows, cols), dt may then be per
+    member. The arrays of the result live in the buffers of work called name, so they are
+    only valid until the next call with the same name."""
+    work = work or Workspace()
+    rows, cols = u.shape[-2:]
+    interior = u.shape[:-2] + (rows - 2, cols - 2)
+    dt0 = _per_member(dt, u) * rows
+    base_i, base_j = _base_coordinates(rows, cols, u.dtype)
+
+    x = work.get(f"{name}_x", interior, u.dtype)
+    np.multiply(dt0, u[..., 1:-1, 1:-1], out=x)
+    np.subtract(base_i, x, out=x)
+    y = work.get(f"{name}_y", interior, u.dtype)
+    np.multiply(dt0, v[..., 1:-1, 1:-1], out=y)
+    np.subtract(base_j, y, out=y)
 
     np.clip(x, 0.5, rows - 0.5, out=x)
     np.clip(y, 0.5, cols - 0.5, out=y)
 
     # Calculate indices and weights
-    i0 = x.astype(int)
-    j0 = y.astype(int)
-    i1 = i0 + 1
-    j1 = j0 + 1
-    s1 = x - i0
-    s0 = 1 - s1
-    t1 = y - j0
-    t0 = 1 - t1
+    i0 = work.get(f"{name}_i0", interior, np.intp)
+    j0 = work.get(f"{name}_j0", interior, np.intp)
+    np.copyto(i0, x, casting="unsafe")  # truncation, like x.astype(int)
+    np.copyto(j0, y, casting="unsafe")
+    # dtype= keeps the arithmetic in the grid's precision instead of promoting the
+    # integer indices to float64
+    s1 = np.subtract(x, i0, out=x, dtype=x.dtype)
+    s0 = np.subtract(1, s1, out=work.get(f"{name}_s0", interior, u.dtype))
+    t1 = np.subtract(y, j0, out=y, dtype=y.dtype)
+    t0 = np.subtract(1, t1, out=work.get(f"{name}_t0", interior, u.dtype))
+
+    # flat indices of the rows and columns of the 4 corners, the far ones clamped to the
+    # last row and column like in the Numba kernel
+    row0 = np.multiply(i0, cols, out=i0)
+    row1 = work.get(f"{name}_row1", interior, np.intp)
+    np.add(row0, cols, out=row1)
+    np.minimum(row1, (rows - 1) * cols, out=row1)
+    col0 = j0
+    col1 = work.get(f"{name}_col1", interior, np.intp)
+    np.add(col0, 1, out=col1)
+    np.minimum(col1, cols - 1, out=col1)
+    if u.ndim == 3:
+        # members of a stack only sample their own grid
+        offsets = np.arange(u.shape[0])[:, None, None] * (rows * cols)
+        row0 += offsets
+        row1 += offsets
+
+    return Backtrace(
+        u.shape,
+        np.add(row0, col0, out=work.get(f"{name}_idx00", interior, np.intp)),
+        np.add(row0, col1, out=work.get(f"{name}_idx01", interior, np.intp)),
+        np.add(row1, col0, out=work.get(f"{name}_idx10", interior, np.intp)),
+        np.add(row1, col1, out=work.get(f"{name}_idx11", interior, np.intp)),
+        s0,
+        s1,
+        t0,
+        t1,
+    )
+
+
+def interpolate(
+    grid: np.ndarray,
+    trace: Backtrace,
+    boundary,
+    b: Flow,
+    out: Optional[np.ndarray] = None,
+    work: Optional[Workspace] = None,
+) -> np.ndarray:
+    """Returns a new grid, where every interior cell is the value of grid at the cell's
+    departure point in trace. If out is given, the result is written into it (it must not
+    be grid)."""
+    assert grid.shape == trace.shape
+    work = work or Workspace()
+    new_grid = np.empty_like(grid) if out is None else out
+    np.copyto(new_grid, grid)
+    rows, cols = grid.shape[-2:]
+    interior = grid.shape[:-2] + (rows - 2, cols - 2)
+
+    flat = grid.reshape(-1)
+    corner = work.get("advect_corner", interior, grid.dtype)
+
+    def gather(idx: np.ndarray, out: np.ndarray) -> np.ndarray:
+        # the indices are in bounds, mode="clip" only spares np.take a buffered copy
+        return np.take(flat, idx, out=out, mode="clip")
 
     # Perform bilinear interpolation
-    new_grid[1:-1, 1:-1] = s0 * (t0 * grid[i0, j0] + t1 * grid[i0, j1]) + s1 * (
-        t0 * grid[i1, j0] + t1 * grid[i1, j1]
-    )
+    # s0 * (t0 * grid[i0, j0] + t1 * grid[i0, j1]) + s1 * (t0 * grid[i1, j0] + t1 * grid[i1, j1])
+    top = gather(trace.idx00, work.get("advect_top", interior, grid.dtype))
+    top *= trace.t0
+    top += np.multiply(trace.t1, gather(trace.idx01, corner), out=corner)
+    top *= trace.s0
+    bottom = gather(trace.idx10, work.get("advect_bottom", interior, grid.dtype))
+    bottom *= trace.t0
+    bottom += np.multiply(trace.t1, gather(trace.idx11, corner), out=corner)
+    bottom *= trace.s1
+    np.add(top, bottom, out=new_grid[..., 1:-1, 1:-1])
 
     boundary.apply(new_grid, b)
     return new_grid
 
 
-def project(u: np.ndarray, v: np.ndarray, boundary) -> Tuple[np.ndarray, np.ndarray]:
-    div = np.zeros_like(u)
-    p = np.zeros_like(div)
-    rows, cols = div.shape
-    h = 1.0 / max(rows, cols)
+def corner_bounds(
+    grid: np.ndarray, trace: Backtrace, work: Optional[Workspace] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the smallest and largest of the 4 values of grid that every interior cell
+    is interpolated from along trace. The arrays live in work."""
+    work = work or Workspace()
+    interior = trace.s0.shape
+    flat = grid.reshape(-1)
+    lo = work.get("bounds_lo", interior, grid.dtype)
+    hi = work.get("bounds_hi", interior, grid.dtype)
+    np.take(flat, trace.idx00, out=lo, mode="clip")
+    np.copyto(hi, lo)
+    corner = work.get("bounds_corner", interior, grid.dtype)
+    for idx in (trace.idx01, trace.idx10, trace.idx11):
+        np.take(flat, idx, out=corner, mode="clip")
+        np.minimum(lo, corner, out=lo)
+        np.maximum(hi, corner, out=hi)
+    return lo, hi
+
+
+def maccormack(
+    grid: np.ndarray,
+    trace: Backtrace,
+    forward: Backtrace,
+    boundary,
+    b: Flow,
+    out: Optional[np.ndarray] = None,
+    work: Optional[Workspace] = None,
+) -> np.ndarray:
+    """Returns a new grid advected with the MacCormack scheme. The semi-Lagrangian
+    result along trace is traced forward again along forward, and half of the difference
+    to grid is its error estimate, which is added to it. That makes the scheme second order.
+    The result is limited to the values it was interpolated from, so the correction
+    cannot create new extrema. If out is given, the result is written into it (it must
+    not be grid)."""
+    work = work or Workspace()
+    new_grid = np.empty_like(grid) if out is None else out
+    predicted = work.get("maccormack_predicted", grid.shape, grid.dtype)
+    interpolate(grid, trace, boundary, b, predicted, work)
+    reverted = work.get("maccormack_reverted", grid.shape, grid.dtype)
+    interpolate(predicted, forward, boundary, b, reverted, work)
+
+    # predicted + (grid - reverted) / 2
+    np.subtract(grid, reverted, out=new_grid)
+    new_grid *= 0.5
+    new_grid += predicted
+
+    lo, hi = corner_bounds(grid, trace, work)
+    interior = new_grid[..., 1:-1, 1:-1]
+    np.clip(interior, lo, hi, out=interior)
+    boundary.apply(new_grid, b)
+    return new_grid
+
+
+def advect(
+    grid: np.ndarray,
+    boundary,
+    b: Flow,
+    u: np.ndarray,
+    v: np.ndarray,
+    dt: float,
+    out: Optional[np.ndarray] = None,
+    work: Optional[Workspace] = None,
+    scheme: Advection = Advection.SEMI_LAGRANGIAN,
+) -> np.ndarray:
+    """Returns a new modified grid, where the velocities, u and v, are applied to the grid cell values.
+    If out is given, the result is written into it (it must not be grid, u or v).
+    grid, u and v may be stacks of shape (B, rows, cols), dt may then be per member."""
+    return advect_fields((grid,), (b,), boundary, u, v, dt, (out,), work, scheme)[0]
 
-    up_u = u[:-2, 1:-1]
-    down_u = u[2:, 1:-1]
-    left_v = v[1:-1, :-2]
-    right_v = v[1:-1, 2:]
 
-    div[1:-1, 1:-1] = -0.5 * h * (up_u - down_u + right_v - left_v)
+def advect_fields(
+    fields: Sequence[np.ndarray],
+    flows: Sequence[Flow],
+    boundary,
+    u: np.ndarray,
+    v: np.ndarray,
+    dt: float,
+    outs: Optional[Sequence[np.ndarray]] = None,
+    work: Optional[Workspace] = None,
+    scheme: Advection = Advection.SEMI_LAGRANGIAN,
+) -> list:
+    """Advects every field, with the boundary flow of the same position in flows, along
+    the same velocities. The backtrace is computed once and shared by all of them.
+    If outs are given, the results are written into them (they must not be any of the
+    fields, u or v)."""
+    work = work or Workspace()
+    outs = outs or [None] * len(fields)
+    trace = backtrace(u, v, dt, work)
+    if scheme == Advection.SEMI_LAGRANGIAN:
+        return [
+            interpolate(field, trace, boundary, b, out, work)
+            for field, b, out in zip(fields, flows, outs)
+        ]
+    elif scheme == Advection.MACCORMACK:
+        forward = backtrace(u, v, -_per_member(dt, u), work, "advect_forward")
+        return [
+            maccormack(field, trace, forward, boundary, b, out, work)
+            for field, b, out in zip(fields, flows, outs)
+        ]
+    else:
+        raise Exception(f"Advection: Invalid enum item '{scheme}'")
+
+
+def project(
+    u: np.ndarray,
+    v: np.ndarray,
+    boundary,
+    solver: Optional[SolverOptions] = None,
+    work: Optional[Workspace] = None,
+    bands: Optional[RowBands] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Makes u and v divergence free in place. The stencil updates of the divergence,
+    the Jacobi sweeps and the gradient are split into the row bands of bands, if given.
+    u and v may be stacks of shape (B, rows, cols)."""
+    solver = solver or SolverOptions()
+    work = work or Workspace()
+    bands = bands or RowBands()
+    div = work.get("div", u.shape, u.dtype)
+    p = work.get("p", u.shape, u.dtype)
+    div.fill(0)
+    p.fill(0)
+    rows, cols = div.shape[-2:]
+    h = 1.0 / max(rows, cols)
+    tmp = work.get("project", u.shape[:-2] + (rows - 2, cols - 2), u.dtype)
+
+    # in every band function below, interior rows start..stop are rows
+    # start + 1..stop + 1 of the padded grids
+
+    def divergence(start: int, stop: int) -> None:
+        t = tmp[..., start:stop, :]
+        # -0.5 * h * (up_u - down_u + right_v - left_v)
+        np.subtract(u[..., start:stop, 1:-1], u[..., start + 2 : stop + 2, 1:-1], out=t)
+        t += v[..., start + 1 : stop + 1, 2:]
+        t -= v[..., start + 1 : stop + 1, :-2]
+        np.multiply(-0.5 * h, t, out=div[..., start + 1 : stop + 1, 1:-1])
+
+    def sweep(start: int, stop: int) -> None:
+        t = tmp[..., start:stop, :]
+        # (div + up + down + left + right) / 4, without temporaries
+        np.add(div[..., start + 1 : stop + 1, 1:-1], p[..., start:stop, 1:-1], out=t)
+        t += p[..., start + 2 : stop + 2, 1:-1]
+        t += p[..., start + 1 : stop + 1, :-2]
+        t += p[..., start + 1 : stop + 1, 2:]
+        t /= 4
+
+    def store(start: int, stop: int) -> None:
+        p[..., start + 1 : stop + 1, 1:-1] = tmp[..., start:stop, :]
+
+    def subtract_gradient(start: int, stop: int) -> None:
+        t = tmp[..., start:stop, :]
+        # u -= 0.5 * (up - down) / h, v -= 0.5 * (right - left) / h
+        np.subtract(p[..., start:stop, 1:-1], p[..., start + 2 : stop + 2, 1:-1], out=t)
+        t *= 0.5
+        t /= h
+        u[..., start + 1 : stop + 1, 1:-1] -= t
+        np.subtract(p[..., start + 1 : stop + 1, 2:], p[..., start + 1 : stop + 1, :-2], out=t)
+        t *= 0.5
+        t /= h
+        v[..., start + 1 : stop + 1, 1:-1] -= t
+
+    bands.run(divergence, rows - 2)
 
     boundary.apply(div, Flow.NONE)
     boundary.apply(p, Flow.NONE)
 
-    up = p[:-2, 1:-1]
-    down = p[2:, 1:-1]
-    left = p[1:-1, :-2]
-    right = p[1:-1, 2:]
+    if not solver.uses_jacobi(boundary):
+        solve(p, div, 1, 4, boundary, Flow.NONE, solver)
+    else:
+        for _ in range(solver.max_iter):
+            bands.run(sweep, rows - 2)
+            bands.run(store, rows - 2)
 
-    for _ in range(20):
-        p[1:-1, 1:-1] = (div[1:-1, 1:-1] + up + down + left + right) / 4
+            boundary.apply(p, Flow.NONE)
+        solver.iterations = solver.max_iter
 
-        boundary.apply(p, Flow.NONE)
-
-    u[1:-1, 1:-1] = u[1:-1, 1:-1] - 0.5 * (up - down) / h
-    v[1:-1, 1:-1] = v[1:-1, 1:-1] - 0.5 * (right - left) / h
+    bands.run(subtract_gradient, rows - 2)
 
     boundary.apply(u, Flow.VERTICAL)
     boundary.apply(v, Flow.HORIZONTAL)
     return u, v
 
 
+def solve(
+    x: np.ndarray,
+    rhs: np.ndarray,
+    a: float,
+    c: float,
+    boundary,
+    flow: Flow,
+    solver: SolverOptions,
+) -> None:
+    """Solves c * x - a * (x_up + x_down + x_left + x_right) = rhs inplace for the fluid cells,
+    with the solid cells of x set by the boundary handler. x is the initial guess.
+
+    Both the implicit diffusion (c = 1 + 4a) and the pressure equation (a = 1, c = 4)
+    have this form. The number of iterations used is stored in solver.iterations.
+
+    x and rhs may be stacks of shape (B, rows, cols), with a and c scalars or per member.
+    The spectral solver handles the whole stack at once, the iterative solvers take their
+    norms and step sizes per member, so they solve the members one by one.
+    """
+    if x.ndim == 3 and not (solver.spectral and boundary.box_only):
+        iterations = 0
+        for k in range(x.shape[0]):
+            solve(x[k], rhs[k], _member(a, k), _member(c, k), boundary, flow, solver)
+            iterations = max(iterations, solver.iterations)
+        solver.iterations = iterations
+    elif solver.spectral and boundary.box_only:
+        spectral(x, rhs, a, c, boundary, flow)
+        solver.iterations = 1
+    elif solver.solver == Solver.MULTIGRID:
+        solver.iterations = multigrid(x, rhs, a, c, boundary, flow, solver.cycles, solver.tol)
+    elif solver.solver == Solver.CG:
+        solver.iterations = conjugate_gradient(
+            x, rhs, a, c, boundary, flow, solver.max_iter, solver.tol
+        )
+    elif solver.solver == Solver.SOR:
+        solver.iterations = red_black_sor(
+            x, rhs, a, c, boundary, flow, solver.max_iter, solver.tol, solver.omega
+        )
+    else:
+        raise Exception(f"Solver: Invalid enum item '{solver.solver}'")
+
+
+def spectral(
+    x: np.ndarray, rhs: np.ndarray, a: float, c: float, boundary, flow: Flow
+) -> None:
+    """Solves the system of `solve` exactly with FFTs, when the only solids are the walls
+    of the outer box.
+
+    The walls mirror the interior, with the sign of the flow's multipliers, so extending the
+    interior by its mirror images along both axes turns the system into a periodic one,
+    which is diagonal in Fourier space.
+    """
+    assert boundary.box_only
+    m_v, m_h = SolidsHandler.multipliers(flow)
+    rows, cols = x.shape[-2] - 2, x.shape[-1] - 2
+
+    interior = rhs[..., 1:-1, 1:-1]
+    extended = np.concatenate((interior, m_v * interior[..., ::-1, :]), axis=-2)
+    extended = np.concatenate((extended, m_h * extended[..., :, ::-1]), axis=-1)
+
+    # eigenvalues of the periodic stencil, for every frequency of the rfft2
+    k = np.cos(np.pi * np.arange(2 * rows, dtype=x.dtype) / rows)[:, None]
+    l = np.cos(np.pi * np.arange(cols + 1, dtype=x.dtype) / cols)[None, :]
+    eigenvalues = c - 2 * a * (k + l)
+
+    transformed = np.fft.rfft2(extended)
+    # a zero eigenvalue belongs to the constant mode of the pure Neumann pressure equation,
+    # which is only defined up to a constant, so that mode is dropped
+    singular = eigenvalues == 0
+    eigenvalues[singular] = 1
+    transformed /= eigenvalues
+    transformed[..., singular] = 0
+
+    x[..., 1:-1, 1:-1] = np.fft.irfft2(transformed, s=extended.shape[-2:])[
+        ..., :rows, :cols
+    ]
+    boundary.apply(x, flow)
+
+
+def residual(x: np.ndarray, rhs: np.ndarray, a: float, c: float, boundary) -> np.ndarray:
+    """Returns rhs - (c * x - a * (x_up + x_down + x_left + x_right)) on the interior of
+    the grid, zero in solid cells. The solid cells of x have to be up to date."""
+    neighbours = x[:-2, 1:-1] + x[2:, 1:-1] + x[1:-1, :-2] + x[1:-1, 2:]
+    return (rhs[1:-1, 1:-1] + a * neighbours - c * x[1:-1, 1:-1]) * boundary.mask_neg[
+        1:-1, 1:-1
+    ]
+
+
+def conjugate_gradient(
+    x: np.ndarray,
+    rhs: np.ndarray,
+    a: float,
+    c: float,
+    boundary,
+    flow: Flow,
+    max_iter: int = 20,
+    tol: float = 0.0,
+) -> int:
+    """Matrix-free conjugate gradient with a diagonal (Jacobi) preconditioner, see `solve`.
+
+    The matrix is only ever applied through the stencil slices and the boundary handler.
+    Returns the number of iterations used.
+    """
+    fluid = boundary.mask_neg[1:-1, 1:-1]
+    # the diagonal of the matrix is c, minus the part of the cell the walls reflect back
+    diag = c - a * boundary.self_weight(flow)[1:-1, 1:-1]
+    diag[~fluid | (diag == 0)] = 1
+
+    boundary.apply(x, flow)
+    r = residual(x, rhs, a, c, boundary)
+    z = r / diag
+    rz = np.vdot(r, z)
+    threshold = tol * np.linalg.norm(rhs[1:-1, 1:-1] * fluid)
+
+    d = np.zeros_like(x)
+    d[1:-1, 1:-1] = z
+
+    iterations = max_iter
+    for k in range(max_iter):
+        if np.linalg.norm(r) <= threshold:
+            iterations = k
+            break
+
+        boundary.apply(d, flow)
+        # the matrix applied to d is the residual of d with zero right hand side, negated
+        ad = -residual(d, np.zeros_like(d), a, c, boundary)
+        dad = np.vdot(d[1:-1, 1:-1], ad)
+        if dad <= 0:
+            # converged into the null space of the pure Neumann pressure equation
+            iterations = k
+            break
+
+        alpha = rz / dad
+        x[1:-1, 1:-1] += alpha * d[1:-1, 1:-1]
+        r -= alpha * ad
+
+        z = r / diag
+        rz_new = np.vdot(r, z)
+        d[1:-1, 1:-1] = z + (rz_new / rz) * d[1:-1, 1:-1] * fluid
+        rz = rz_new
+
+    boundary.apply(x, flow)
+    return iterations
+
+
+def red_black_sor(
+    x: np.ndarray,
+    rhs: np.ndarray,
+    a: float,
+    c: float,
+    boundary,
+    flow: Flow,
+    max_iter: int = 20,
+    tol: float = 0.0,
+    omega: float = 1.0,
+) -> int:
+    """Successive over-relaxation in red-black order, see `solve`. Returns the number of
+    sweeps used.
+
+    Every cell only depends on cells of the other color, so each half sweep is a single
+    vectorized update of the strided slices of one color, using the values the other color
+    got in the same sweep, as in Gauss-Seidel.
+    """
+    threshold = tol * np.linalg.norm(rhs[1:-1, 1:-1] * boundary.mask_neg[1:-1, 1:-1])
+    boundary.apply(x, flow)
+
+    for k in range(max_iter):
+        if tol > 0 and np.linalg.norm(residual(x, rhs, a, c, boundary)) <= threshold:
+            return k
+        _red_black_sweep(x, rhs, a, c, boundary, flow, omega)
+    return max_iter
+
+
+def _red_black_sweep(
+    x: np.ndarray,
+    rhs: np.ndarray,
+    a: float,
+    c: float,
+    boundary,
+    flow: Flow,
+    omega: float,
+) -> None:
+    rows, cols = x.shape[0] - 2, x.shape[1] - 2
+
+    # (row, col) offsets of the 2x2 sublattices, red cells first then black cells
+    for color in (((0, 0), (1, 1)), ((0, 1), (1, 0))):
+        for di, dj in color:
+            i = slice(1 + di, rows + 1, 2)
+            j = slice(1 + dj, cols + 1, 2)
+            neighbours = (
+                x[di:rows:2, j]
+                + x[2 + di : rows + 2 : 2, j]
+                + x[i, dj:cols:2]
+                + x[i, 2 + dj : cols + 2 : 2]
+            )
+            x[i, j] += omega * ((rhs[i, j] + a * neighbours) / c - x[i, j])
+        boundary.apply(x, flow)
+
+
+@dataclass
+class MultigridLevel:
+    """The geometry of one multigrid level, derived from the fluid cells of the fine grid.
+
+    A coarse cell stands for the 2x2 cells of the level above it, n counts the fine fluid
+    cells it covers. wx and wy are the conductances of the open faces between horizontal
+    and vertical neighbours, ch and cv the weights of the faces that lead into solid
+    cells, which reflect the cell's own value back with the sign of the flow. On a coarse
+    level a face gets half the sum of the faces it covers, the same as rediscretizing the
+    stencil at twice the cell size, so the levels of a domain without obstacles match
+    the usual coarse operator while walls stay closed on every level.
+
+    A solid cell with several fluid neighbours is set to their mean by apply, which
+    couples them through the solid. On the fine level such a cell is a node without
+    fluid that is open towards its fluid neighbours, which couples them the same way,
+    so the coarse levels see that a wall only one cell thick is not closed.
+    """
+
+    n: np.ndarray
+    wx: np.ndarray
+    wy: np.ndarray
+    ch: np.ndarray
+    cv: np.ndarray
+    _regions: Optional[np.ndarray] = field(default=None, init=False, repr=False)
+
+    @classmethod
+    def fine(cls, mask_neg: np.ndarray) -> "MultigridLevel":
+        """Returns the level of the interior of a padded grid with fluid cells mask_neg."""
+        fluid = mask_neg.astype(np.float64)
+        n = fluid[1:-1, 1:-1]
+        neighbours = fluid[:-2, 1:-1] + fluid[2:, 1:-1] + fluid[1:-1, :-2] + fluid[1:-1, 2:]
+        # solid cells that couple their fluid neighbours, the border never does
+        coupling = np.zeros_like(fluid)
+        coupling[1:-1, 1:-1] = (1 - n) * (neighbours >= 2)
+        node = n + coupling[1:-1, 1:-1]
+        return cls(
+            n=n,
+            # faces between two solid cells stay closed, the mean only takes fluid cells
+            wx=node[:, :-1] * node[:, 1:] * np.maximum(n[:, :-1], n[:, 1:]),
+            wy=node[:-1, :] * node[1:, :] * np.maximum(n[:-1, :], n[1:, :]),
+            ch=n * (2 - fluid[1:-1, :-2] - fluid[1:-1, 2:]),
+            cv=n * (2 - fluid[:-2, 1:-1] - fluid[2:, 1:-1]),
+        )
+
+    def coarsen(self) -> "MultigridLevel":
+        """Returns the level with half the resolution."""
+        rows, cols = self.n.shape
+        coarse_rows, coarse_cols = (rows + 1) // 2, (cols + 1) // 2
+
+        def blocks(arr: np.ndarray) -> np.ndarray:
+            padded = np.zeros((2 * coarse_rows, 2 * coarse_cols))
+            padded[: arr.shape[0], : arr.shape[1]] = arr
+            return padded.reshape(coarse_rows, 2, coarse_cols, 2)
+
+        wx = blocks(self.wx)[:, :, :-1, 1].sum(axis=1)
+        wy = blocks(self.wy)[:-1, 1, :, :].sum(axis=2)
+        return MultigridLevel(
+            n=blocks(self.n).sum(axis=(1, 3)),
+            wx=0.5 * wx,
+            wy=0.5 * wy,
+            ch=0.5 * blocks(self.ch).sum(axis=(1, 3)),
+            cv=0.5 * blocks(self.cv).sum(axis=(1, 3)),
+        )
+
+    def splits(self) -> bool:
+        """True if a 2x2 block of cells with fluid is not connected through its own open
+        faces, e.g. across a wall, so that coarsening would merge cells it separates."""
+        rows, cols = self.n.shape
+        coarse_rows, coarse_cols = (rows + 1) // 2, (cols + 1) // 2
+
+        def blocks(arr: np.ndarray) -> np.ndarray:
+            padded = np.zeros((2 * coarse_rows, 2 * coarse_cols), dtype=bool)
+            padded[: arr.shape[0], : arr.shape[1]] = arr > 0
+            return padded.reshape(coarse_rows, 2, coarse_cols, 2)
+
+        cells = blocks(self.n).sum(axis=(1, 3))
+        faces = blocks(self.wx)[:, :, :, 0].sum(axis=1) + blocks(self.wy)[:, 0].sum(axis=2)
+        # the faces of a block form a ring of 4, so they only close a loop if all are open
+        loops = (cells == 4) & (faces == 4)
+        return bool((cells - faces + loops > 1).any())
+
+    def regions(self) -> np.ndarray:
+        """Returns a label for every cell, equal for the cells connected through open
+        faces. Cells without fluid are labelled too, but their labels are not used."""
+        if self._regions is None:
+            labels = np.arange(self.n.size).reshape(self.n.shape)
+            # closed faces pass on a label larger than any, which never wins the minimum
+            none = labels.size
+            open_x, open_y = self.wx > 0, self.wy > 0
+            while True:
+                # every cell takes the smallest label of itself and its open neighbours
+                new = labels.copy()
+                np.minimum(new[:, :-1], np.where(open_x, labels[:, 1:], none), out=new[:, :-1])
+                np.minimum(new[:, 1:], np.where(open_x, labels[:, :-1], none), out=new[:, 1:])
+                np.minimum(new[:-1, :], np.where(open_y, labels[1:, :], none), out=new[:-1, :])
+                np.minimum(new[1:, :], np.where(open_y, labels[:-1, :], none), out=new[1:, :])
+                if np.array_equal(new, labels):
+                    break
+                labels = new
+            self._regions = labels
+        return self._regions
+
+    def neighbours(self, e: np.ndarray) -> np.ndarray:
+        """Returns the sum of the neighbours of every cell of e, weighted by their faces."""
+        total = np.zeros_like(e)
+        total[:, :-1] += self.wx * e[:, 1:]
+        total[:, 1:] += self.wx * e[:, :-1]
+        total[:-1, :] += self.wy * e[1:, :]
+        total[1:, :] += self.wy * e[:-1, :]
+        return total
+
+    def diagonal(self, a: float, c: float, flow: Flow) -> np.ndarray:
+        """Returns the diagonal of the level's operator for the system of `solve`."""
+        m_v, m_h = SolidsHandler.multipliers(flow)
+        faces = np.zeros_like(self.n)
+        faces[:, :-1] += self.wx
+        faces[:, 1:] += self.wx
+        faces[:-1, :] += self.wy
+        faces[1:, :] += self.wy
+        return (c - 4 * a) * self.n + a * ((1 - m_h) * self.ch + (1 - m_v) * self.cv + faces)
+
+
+def multigrid(
+    x: np.ndarray,
+    rhs: np.ndarray,
+    a: float,
+    c: float,
+    boundary,
+    flow: Flow,
+    cycles: int = 2,
+    tol: float = 0.0,
+    smooth: int = 2,
+) -> int:
+    """Geometric multigrid V-cycles, see `solve`. Returns the number of cycles used.
+
+    The fine level is smoothed with the exact stencil and boundary handler. The coarse
+    levels come from boundary.multigrid_levels: a coarse residual is the sum of the fine
+    residuals it covers, and the coarse correction is copied back to the fluid cells only,
+    so no correction leaks through the obstacles on any level.
+    """
+    threshold = tol * np.linalg.norm(rhs[1:-1, 1:-1] * boundary.mask_neg[1:-1, 1:-1])
+    boundary.apply(x, flow)
+
+    for k in range(cycles):
+        if tol > 0 and np.linalg.norm(residual(x, rhs, a, c, boundary)) <= threshold:
+            return k
+        _v_cycle(x, rhs, a, c, boundary, flow, smooth)
+    return cycles
+
+
+def _restrict(fine: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """Returns the sums of the 2x2 blocks of fine on a grid of shape."""
+    padded = np.zeros((2 * shape[0], 2 * shape[1]), dtype=fine.dtype)
+    padded[: fine.shape[0], : fine.shape[1]] = fine
+    return padded.reshape(shape[0], 2, shape[1], 2).sum(axis=(1, 3))
+
+
+def _prolong(coarse: np.ndarray, active: np.ndarray) -> np.ndarray:
+    """Returns the correction of the fine cells, each coarse cell copied to its 2x2 fine
+    cells, and zero in the cells that are not active, e.g. the solid ones."""
+    rows, cols = active.shape
+    return coarse.repeat(2, axis=0).repeat(2, axis=1)[:rows, :cols] * active
+
+
+def _v_cycle(
+    x: np.ndarray,
+    rhs: np.ndarray,
+    a: float,
+    c: float,
+    boundary,
+    flow: Flow,
+    smooth: int,
+) -> None:
+    levels = boundary.multigrid_levels()
+    if not levels:
+        # the grid is only a few cells wide, relaxing it is as good as solving it
+        _relax(x, rhs, a, c, boundary, flow, 50)
+        return
+
+    _relax(x, rhs, a, c, boundary, flow, smooth)
+
+    fluid = boundary.mask_neg[1:-1, 1:-1]
+    coarse_rhs = _restrict(residual(x, rhs, a, c, boundary), levels[0].n.shape)
+    error = np.zeros_like(coarse_rhs)
+    _coarse_v_cycle(error, coarse_rhs, a, c, flow, levels, smooth)
+
+    x[1:-1, 1:-1] += _prolong(error, fluid)
+    boundary.apply(x, flow)
+
+    _relax(x, rhs, a, c, boundary, flow, smooth)
+
+
+def _coarse_v_cycle(
+    e: np.ndarray,
+    r: np.ndarray,
+    a: float,
+    c: float,
+    flow: Flow,
+    levels: Sequence[MultigridLevel],
+    smooth: int,
+    omega: float = 0.8,
+) -> None:
+    """A V-cycle on the coarse levels, with damped Jacobi sweeps on the level operator."""
+    level = levels[0]
+    diagonal = level.diagonal(a, c, flow)
+    # cells without fluid or open faces, e.g. inside a wall, stay at zero
+    active = diagonal > 0
+    inverse = np.divide(1, diagonal, out=np.zeros_like(diagonal), where=active)
+
+    def relax(sweeps: int) -> None:
+        for _ in range(sweeps):
+            e[:] += omega * ((r + a * level.neighbours(e)) * inverse - e)
+
+    if len(levels) == 1:
+        _coarse_solve(e, r, a, level, diagonal, inverse)
+        return
+
+    relax(smooth)
+    coarse_r = _restrict(r - diagonal * e + a * level.neighbours(e), levels[1].n.shape)
+    error = np.zeros_like(coarse_r)
+    _coarse_v_cycle(error, coarse_r, a, c, flow, levels[1:], smooth, omega)
+    e += _prolong(error, active)
+    relax(smooth)
+
+
+def _coarse_solve(
+    e: np.ndarray,
+    r: np.ndarray,
+    a: float,
+    level: MultigridLevel,
+    diagonal: np.ndarray,
+    inverse: np.ndarray,
+    tol: float = 1e-3,
+) -> None:
+    """Solves the coarsest level with Jacobi preconditioned conjugate gradients. The
+    level operator is symmetric, and on the coarsest level a few dozen cells wide CG
+    needs far fewer iterations than relaxing it."""
+    # the pure Neumann pressure equation only has a solution if the right hand side sums
+    # to zero over every connected region, the rest of it is dropped. Its constants
+    # solve the homogeneous equation, so they are kept out of the search directions.
+    labels = level.regions().ravel()
+    size = labels.size
+    active = diagonal > 0
+    row_sums = np.abs(diagonal - a * level.neighbours(np.ones_like(e)))
+    counts = np.bincount(labels, active.ravel(), size)
+    singular = np.bincount(labels, row_sums.ravel(), size) <= 1e-9 * abs(a) * counts
+    null = singular[labels].reshape(e.shape) & active
+
+    def drop_null(arr: np.ndarray) -> np.ndarray:
+        means = np.bincount(labels, (arr * null).ravel(), size) / np.maximum(counts, 1)
+        return arr - means[labels].reshape(e.shape) * null
+
+    r = drop_null(r)
+    res = r - diagonal * e + a * level.neighbours(e)
+    z = drop_null(res * inverse)
+    d = z.copy()
+    rz = np.vdot(res, z)
+    threshold = tol * np.linalg.norm(res)
+
+    for _ in range(e.size):
+        if np.linalg.norm(res) <= threshold:
+            break
+        ad = diagonal * d - a * level.neighbours(d)
+        dad = np.vdot(d, ad)
+        if dad <= 0:
+            # only rounding errors are left in the search direction
+            break
+        alpha = rz / dad
+        e += alpha * d
+        res -= alpha * ad
+        z = drop_null(res * inverse)
+        rz_new = np.vdot(res, z)
+        d = z + (rz_new / rz) * d
+        rz = rz_new
+
+
+def _relax(
+    x: np.ndarray,
+    rhs: np.ndarray,
+    a: float,
+    c: float,
+    boundary,
+    flow: Flow,
+    sweeps: int,
+    omega: float = 0.8,
+) -> None:
+    """Damped Jacobi sweeps, the multigrid smoother."""
+    up = x[:-2, 1:-1]
+    down = x[2:, 1:-1]
+    left = x[1:-1, :-2]
+    right = x[1:-1, 2:]
+
+    for _ in range(sweeps):
+        x[1:-1, 1:-1] += omega * (
+            (rhs[1:-1, 1:-1] + a * (up + down + left + right)) / c - x[1:-1, 1:-1]
+        )
+        boundary.apply(x, flow)
+
+
 def set_bound_bad(grid: np.ndarray) -> np.ndarray:
     new_grid = np.copy(grid)
     rows, cols = grid.shape
@@ -338,12 +1306,16 @@ def dense_step(
     boundary,
     diff: float,
     dt: float,
+    solver: Optional[SolverOptions] = None,
+    advection: Advection = Advection.SEMI_LAGRANGIAN,
 ) -> np.ndarray:
     """Simulates on step for the density simulation. Returns a new modified grid.
-    add sources, diffusion, advection"""
+    add sources, diffusion, advection
+
+    The fields may be stacks of shape (B, rows, cols) with diff and dt per member."""
     add_source(grid, source, dt)
-    grid = diffuse(grid, boundary, Flow.NONE, diff, dt)
-    grid = advect(grid, boundary, Flow.NONE, u, v, dt)
+    grid = diffuse(grid, boundary, Flow.NONE, diff, dt, solver)
+    grid = advect(grid, boundary, Flow.NONE, u, v, dt, scheme=advection)
     return grid
 
 
@@ -355,18 +1327,439 @@ def vel_step(
     boundary,
     visc: float,
     dt: float,
+    diffuse_solver: Optional[SolverOptions] = None,
+    pressure_solver: Optional[SolverOptions] = None,
+    sequential_advection: bool = False,
+    advection: Advection = Advection.SEMI_LAGRANGIAN,
 ) -> Tuple[np.ndarray, np.ndarray]:
+    """Simulates one step of the velocity fields. Returns the new u and v.
+    add sources, diffusion, projection, advection, projection
+
+    u and v are advected along the same backtrace, unless sequential_advection is set,
+    in which case v is advected by the already advected u, as in earlier versions.
+    The fields may be stacks of shape (B, rows, cols) with visc and dt per member."""
     add_source(u, u_source, dt)
     add_source(v, v_source, dt)
-    u = diffuse(u, boundary, Flow.VERTICAL, visc, dt)
-    v = diffuse(v, boundary, Flow.HORIZONTAL, visc, dt)
-    u, v = project(u, v, boundary)
-    u = advect(u, boundary, Flow.VERTICAL, u, v, dt)
-    v = advect(v, boundary, Flow.HORIZONTAL, u, v, dt)
-    u, v = project(u, v, boundary)
+    u = diffuse(u, boundary, Flow.VERTICAL, visc, dt, diffuse_solver)
+    v = diffuse(v, boundary, Flow.HORIZONTAL, visc, dt, diffuse_solver)
+    u, v = project(u, v, boundary, pressure_solver)
+    if sequential_advection:
+        u = advect(u, boundary, Flow.VERTICAL, u, v, dt, scheme=advection)
+        v = advect(v, boundary, Flow.HORIZONTAL, u, v, dt, scheme=advection)
+    else:
+        u, v = advect_fields(
+            (u, v), (Flow.VERTICAL, Flow.HORIZONTAL), boundary, u, v, dt, scheme=advection
+        )
+    u, v = project(u, v, boundary, pressure_solver)
     return u, v
 
 
+def _resample_axis(arr: np.ndarray, n: int, axis: int) -> np.ndarray:
+    """Linearly interpolates arr between cell centres to n cells along axis."""
+    old = arr.shape[axis]
+    x = np.clip((np.arange(n) + 0.5) * old / n - 0.5, 0, old - 1)
+    i0 = x.astype(np.intp)
+    i1 = np.minimum(i0 + 1, old - 1)
+    shape = [1] * arr.ndim
+    shape[axis] = n
+    w = (x - i0).astype(arr.dtype).reshape(shape)
+    return np.take(arr, i0, axis) * (1 - w) + np.take(arr, i1, axis) * w
+
+
+def resample(field: np.ndarray, rows: int, cols: int) -> np.ndarray:
+    """Returns field bilinearly resampled to a padded rows x cols grid. Only the interior
+    is resampled, the boundary rows and columns copy their nearest interior cells and are
+    expected to be set by a SolidsHandler afterwards. field may be a stack of grids."""
+    interior = field[..., 1:-1, 1:-1]
+    interior = _resample_axis(interior, rows - 2, interior.ndim - 2)
+    interior = _resample_axis(interior, cols - 2, interior.ndim - 1)
+    pad = [(0, 0)] * (field.ndim - 2) + [(1, 1), (1, 1)]
+    return np.pad(interior, pad, mode="edge")
+
+
+def _average_axis(arr: np.ndarray, n: int, axis: int) -> np.ndarray:
+    """Averages arr into n equal cells along axis, every old cell weighted by the length
+    it overlaps the new one, so that the mean along the axis is kept."""
+    old = arr.shape[axis]
+    edges = np.arange(n + 1) * old / n
+    cells = np.arange(old)
+    overlap = np.minimum(edges[1:, None], cells + 1) - np.maximum(edges[:-1, None], cells)
+    weights = (np.maximum(overlap, 0) * n / old).astype(arr.dtype)
+    return np.moveaxis(np.tensordot(weights, arr, axes=(1, axis)), 0, axis)
+
+
+def resample_sources(field: np.ndarray, rows: int, cols: int) -> np.ndarray:
+    """Same as resample, except that shrinking axes average the old cells a new cell
+    covers, so that a coarser source adds the same total over the domain and small
+    sources are not skipped between the sampled cell centres."""
+    interior = field[..., 1:-1, 1:-1]
+    for n, axis in ((rows - 2, interior.ndim - 2), (cols - 2, interior.ndim - 1)):
+        if n < interior.shape[axis]:
+            interior = _average_axis(interior, n, axis)
+        else:
+            interior = _resample_axis(interior, n, axis)
+    pad = [(0, 0)] * (field.ndim - 2) + [(1, 1), (1, 1)]
+    return np.pad(interior, pad, mode="edge")
+
+
+def resample_solids(bound: np.ndarray, rows: int, cols: int) -> np.ndarray:
+    """Returns bound resampled to a padded rows x cols grid, every interior cell takes
+    the value of the old cell its centre falls into, the boundary stays solid."""
+    old_rows, old_cols = bound.shape[0] - 2, bound.shape[1] - 2
+    i = ((np.arange(rows - 2) + 0.5) * old_rows / (rows - 2)).astype(np.intp) + 1
+    j = ((np.arange(cols - 2) + 0.5) * old_cols / (cols - 2)).astype(np.intp) + 1
+    new_bound = np.ones((rows, cols), dtype=bound.dtype)
+    new_bound[1:-1, 1:-1] = bound[i[:, None], j[None, :]]
+    return new_bound
+
+
+@dataclass
+class CFLControl:
+    """Splits the time step of a frame into substeps, so that the fastest cell moves at most
+    cfl cells in one substep. Quiet frames are advanced in a single step, violent ones in up
+    to max_substeps steps, see FluidSimulation.substeps.
+
+    An ensemble takes the same substeps in every member, sized by its fastest member, so a
+    member advanced with a control in an ensemble may take more, smaller substeps than it
+    would on its own."""
+
+    cfl: float = 1.0
+    max_substeps: int = 8
+
+    def step_size(self, u: np.ndarray, v: np.ndarray, remaining: float, taken: int) -> float:
+        """Returns the dt of the next substep, with remaining time left in the frame and
+        taken substeps done so far."""
+        # advect moves a cell by dt * rows * (u, v) cells
+        speed = u.shape[-2] * float(max(u.max(), -u.min(), v.max(), -v.min()))
+        if taken + 1 >= self.max_substeps or speed * remaining <= self.cfl:
+            return remaining
+        # split the rest evenly, so that the last substep is not a sliver
+        substeps = math.ceil(speed * remaining / self.cfl)
+        return remaining / min(substeps, self.max_substeps - taken)
+
+
+class FluidSimulation:
+    """
+    Owns the state of a simulation:
+      - the density grid, the velocity fields u and v and their sources
+      - the solids handler and the solver options
+      - every scratch buffer of the steps, allocated once per resolution
+
+    Every field and buffer has the dtype of grid, so passing float32 fields runs the whole
+    simulation in single precision.
+
+    The steps run in place, swapping each field with its spare buffer after every stage,
+    so advancing the simulation does not churn through the allocator.
+    With the Numba backend the Jacobi solves, the semi-Lagrangian advection and the boundary
+    handling run as compiled kernels, other solvers and MacCormack advection still run in
+    NumPy.
+    With more than one worker the NumPy Jacobi diffusion and projection are split into row
+    bands that run on a thread pool, which `close` shuts down. The simulation is also a
+    context manager that closes it on exit.
+
+    The fields may also be stacks of shape (B, rows, cols), an ensemble of B members that
+    share the solids and advance together, with diff and visc given per member. Ensembles
+    always run on the NumPy backend, and share the substeps of a CFLControl.
+    """
+
+    def __init__(
+        self,
+        grid: np.ndarray,
+        source: np.ndarray,
+        u_source: np.ndarray,
+        v_source: np.ndarray,
+        solids: np.ndarray,
+        diff: float,
+        visc: float,
+        diffuse_solver: Optional[SolverOptions] = None,
+        pressure_solver: Optional[SolverOptions] = None,
+        backend: Backend = Backend.NUMPY,
+        workers: int = 1,
+        sequential_advection: bool = False,
+        advection: Advection = Advection.SEMI_LAGRANGIAN,
+    ):
+        self.grid = grid
+        self.u = np.zeros_like(grid)
+        self.v = np.zeros_like(grid)
+        self.source = source
+        self.u_source = u_source
+        self.v_source = v_source
+        self.solids = SolidsHandler(solids)
+        self.diff = diff
+        self.visc = visc
+        self.diffuse_solver = diffuse_solver or SolverOptions()
+        self.pressure_solver = pressure_solver or SolverOptions()
+        self.sequential_advection = sequential_advection
+        self.advection = advection
+
+        self._numba = None
+        if backend == Backend.NUMBA and grid.ndim != 2:
+            warnings.warn("The Numba backend runs single grids only, using NumPy")
+            backend = Backend.NUMPY
+        if backend == Backend.NUMBA:
+            import numba_backend
+
+            if numba_backend.available:
+                self._numba = numba_backend
+            else:
+                warnings.warn("Numba is not installed, falling back to the NumPy backend")
+                backend = Backend.NUMPY
+        self.backend = backend
+
+        self.work = Workspace()
+        self.bands = RowBands(workers)
+        self.stage_times = {"vel_step": 0.0, "dense_step": 0.0}
+        self._grid_next = np.empty_like(grid)
+        self._u_next = np.empty_like(grid)
+        self._v_next = np.empty_like(grid)
+        # the sources and solids every resample starts from, and what the last one made
+        # of them, see resample
+        self._originals: Optional[Tuple[np.ndarray, ...]] = None
+        self._resampled: Optional[Tuple[np.ndarray, ...]] = None
+
+    @classmethod
+    def from_scenario(
+        cls, scenario_id: int, rows: int, cols: int, dtype=np.float64, **kwargs
+    ) -> "FluidSimulation":
+        """Sets up the simulation of one of the test scenarios of utils.get_test_scenario,
+        with every field of the given dtype. The keyword arguments are passed to the
+        constructor."""
+        grid, source, u_source, v_source, solids = utils.get_test_scenario(
+            scenario_id, rows, cols, dtype
+        )
+        return cls(grid, source, u_source, v_source, solids, **kwargs)
+
+    @classmethod
+    def from_scenarios(
+        cls, scenario_ids: Sequence[int], rows: int, cols: int, dtype=np.float64, **kwargs
+    ) -> "FluidSimulation":
+        """Sets up an ensemble with one member for each of the test scenarios, which have to
+        share their solids. The keyword arguments are passed to the constructor, diff and
+        visc may be given per member."""
+        scenarios = [
+            utils.get_test_scenario(scenario_id, rows, cols, dtype)
+            for scenario_id in scenario_ids
+        ]
+        grid, source, u_source, v_source, solids = (
+            np.stack(fields) for fields in zip(*scenarios)
+        )
+        if not (solids == solids[0]).all():
+            raise ValueError(
+                f"Test scenarios {list(scenario_ids)} have different solids, an ensemble "
+                "shares the solids of its members"
+            )
+        return cls(grid, source, u_source, v_source, solids[0], **kwargs)
+
+    def step(self, dt: float) -> None:
+        self.vel_step(dt)
+        self.dense_step(dt)
+
+    def resample(self, rows: int, cols: int) -> None:
+        """Moves the simulation to a padded rows x cols grid. The fields are resampled
+        bilinearly, the sources by resample_sources and the solids to the nearest cell.
+        The velocities need no rescaling, advect already scales them by the resolution.
+
+        The sources and solids are resampled from the ones the simulation had before its
+        first resample, so switching back and forth between resolutions does not blur
+        them further each time. Once they were changed since the last resample, e.g. by
+        painting solids, the changed ones become the originals instead.
+        """
+        current = (self.source, self.u_source, self.v_source, self.solids.bound)
+        if self._resampled is None or not all(
+            np.array_equal(a, b) for a, b in zip(current, self._resampled)
+        ):
+            self._originals = tuple(a.copy() for a in current)
+        source, u_source, v_source, bound = self._originals
+
+        self.grid = resample(self.grid, rows, cols)
+        self.u = resample(self.u, rows, cols)
+        self.v = resample(self.v, rows, cols)
+        self.source = resample_sources(source, rows, cols)
+        self.u_source = resample_sources(u_source, rows, cols)
+        self.v_source = resample_sources(v_source, rows, cols)
+        self.solids = SolidsHandler(resample_solids(bound, rows, cols))
+        self._resampled = tuple(
+            a.copy() for a in (self.source, self.u_source, self.v_source, self.solids.bound)
+        )
+        self.solids.apply(self.grid, Flow.NONE)
+        self.solids.apply(self.u, Flow.VERTICAL)
+        self.solids.apply(self.v, Flow.HORIZONTAL)
+
+        # drop the scratch buffers of the old resolution instead of keeping both
+        self.work = Workspace()
+        self._grid_next = np.empty_like(self.grid)
+        self._u_next = np.empty_like(self.grid)
+        self._v_next = np.empty_like(self.grid)
+
+    def close(self) -> None:
+        """Shuts down the thread pool of the row bands. The simulation can still be
+        advanced afterwards, on the calling thread only."""
+        self.bands.close()
+
+    def __enter__(self) -> "FluidSimulation":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def substeps(self, dt: float, control: CFLControl) -> Iterator[float]:
+        """Yields the dt of every substep of a frame of length dt. The size of each one is
+        chosen from the velocities when it is requested, so the caller has to advance the
+        simulation by the yielded dt before asking for the next one."""
+        remaining, taken = dt, 0
+        while remaining > 0:
+            sub_dt = control.step_size(self.u, self.v, remaining, taken)
+            yield sub_dt
+            taken += 1
+            remaining = 0 if sub_dt >= remaining else remaining - sub_dt
+
+    def advance(self, dt: float, control: Optional[CFLControl] = None) -> int:
+        """Advances the simulation by dt, in the substeps of control if given.
+        Returns the number of steps taken. The seconds spent in each stage are summed up
+        in stage_times."""
+        self.stage_times = {"vel_step": 0.0, "dense_step": 0.0}
+        taken = 0
+        for sub_dt in self.substeps(dt, control) if control else (dt,):
+            t0 = time.perf_counter()
+            with span("vel_step"):
+                self.vel_step(sub_dt)
+            t1 = time.perf_counter()
+            with span("dense_step"):
+                self.dense_step(sub_dt)
+            self.stage_times["vel_step"] += t1 - t0
+            self.stage_times["dense_step"] += time.perf_counter() - t1
+            taken += 1
+        return taken
+
+    def dense_step(self, dt: float) -> None:
+        """Same as the dense_step function, in place."""
+        with span("add_source"):
+            add_source(self.grid, self.source, dt, self.work)
+        self.grid, self._grid_next = self._diffuse(
+            self.grid, self._grid_next, Flow.NONE, self.diff, dt
+        )
+        self.grid, self._grid_next = self._advect(
+            self.grid, self._grid_next, Flow.NONE, dt
+        )
+
+    def vel_step(self, dt: float) -> None:
+        """Same as the vel_step function, in place."""
+        with span("add_source"):
+            add_source(self.u, self.u_source, dt, self.work)
+            add_source(self.v, self.v_source, dt, self.work)
+        self.u, self._u_next = self._diffuse(
+            self.u, self._u_next, Flow.VERTICAL, self.visc, dt
+        )
+        self.v, self._v_next = self._diffuse(
+            self.v, self._v_next, Flow.HORIZONTAL, self.visc, dt
+        )
+        self._project()
+        if self.sequential_advection:
+            self.u, self._u_next = self._advect(self.u, self._u_next, Flow.VERTICAL, dt)
+            self.v, self._v_next = self._advect(self.v, self._v_next, Flow.HORIZONTAL, dt)
+        else:
+            self._advect_velocity(dt)
+        self._project()
+
+    def _diffuse(
+        self, field: np.ndarray, spare: np.ndarray, b: Flow, diff: float, dt: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Diffuses field into spare, returns the new field and the new spare buffer."""
+        with span("diffuse"):
+            if self._numba is not None and self.diffuse_solver.uses_jacobi(self.solids):
+                scratch = self.work.get("numba_diffuse", field.shape, field.dtype)
+                iterations = self.diffuse_solver.max_iter
+                self._numba.diffuse(
+                    field, spare, scratch, self.solids, b, diff, dt, iterations
+                )
+                self.diffuse_solver.iterations = iterations
+            else:
+                diffuse(
+                    field,
+                    self.solids,
+                    b,
+                    diff,
+                    dt,
+                    self.diffuse_solver,
+                    spare,
+                    self.work,
+                    self.bands,
+                )
+        return spare, field
+
+    def _advect(
+        self, field: np.ndarray, spare: np.ndarray, b: Flow, dt: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Advects field into spare, returns the new field and the new spare buffer."""
+        with span("advect"):
+            if self._numba is not None and self.advection == Advection.SEMI_LAGRANGIAN:
+                self._numba.advect(field, spare, self.solids, b, self.u, self.v, dt)
+            else:
+                advect(
+                    field,
+                    self.solids,
+                    b,
+                    self.u,
+                    self.v,
+                    dt,
+                    spare,
+                    self.work,
+                    self.advection,
+                )
+        return spare, field
+
+    def _advect_velocity(self, dt: float) -> None:
+        """Advects u and v along the same backtrace, then swaps both with their spares."""
+        with span("advect"):
+            if self._numba is not None and self.advection == Advection.SEMI_LAGRANGIAN:
+                # the compiled kernel recomputes the backtrace, cheaper than storing it
+                self._numba.advect(
+                    self.u, self._u_next, self.solids, Flow.VERTICAL, self.u, self.v, dt
+                )
+                self._numba.advect(
+                    self.v, self._v_next, self.solids, Flow.HORIZONTAL, self.u, self.v, dt
+                )
+            else:
+                advect_fields(
+                    (self.u, self.v),
+                    (Flow.VERTICAL, Flow.HORIZONTAL),
+                    self.solids,
+                    self.u,
+                    self.v,
+                    dt,
+                    (self._u_next, self._v_next),
+                    self.work,
+                    self.advection,
+                )
+            self.u, self._u_next = self._u_next, self.u
+            self.v, self._v_next = self._v_next, self.v
+
+    def _project(self) -> None:
+        with span("project"):
+            if self._numba is not None and self.pressure_solver.uses_jacobi(self.solids):
+                shape, dtype = self.u.shape, self.u.dtype
+                iterations = self.pressure_solver.max_iter
+                self._numba.project(
+                    self.u,
+                    self.v,
+                    self.work.get("div", shape, dtype),
+                    self.work.get("p", shape, dtype),
+                    self.work.get("numba_p", shape, dtype),
+                    self.solids,
+                    iterations,
+                )
+                self.pressure_solver.iterations = iterations
+            else:
+                project(
+                    self.u,
+                    self.v,
+                    self.solids,
+                    self.pressure_solver,
+                    self.work,
+                    self.bands,
+                )
+
+
 if __name__ == "__main__":
     m = np.zeros((10, 10))
     # m[4:8, 5:7] = 1
@@ -0,0 +1,185 @@
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import tyro
+
+import profiling
+from engine import (
+    Advection,
+    Backend,
+    CFLControl,
+    FluidSimulation,
+    Solver,
+    SolverOptions,
+)
+from checkpoint import CheckpointWriter, load_checkpoint, read_meta
+from recorder import DropPolicy, FrameRecorder, RecordFormat, packed_to_rgb
+from utils import density_pixels
+
+
+@dataclass
+class SimulationArgs:
+    """The options of a simulation, shared by the window of main.py, the headless runs
+    and the parameter sweeps."""
+
+    WIDTH: int = 1200
+    HEIGHT: int = 900
+    test_scenario: int = 1
+    cell_size: int = 10
+    diff: float = 1e-5
+    visc: float = 1e-4
+    diffuse_solver: Solver = Solver.JACOBI
+    pressure_solver: Solver = Solver.JACOBI
+    solver_tol: float = 0.0
+    solver_max_iter: int = 20
+    # V-cycles of the multigrid solver, with --solver-tol it stops early once converged
+    solver_cycles: int = 2
+    solver_omega: float = 1.0
+    spectral: bool = False
+    backend: Backend = Backend.NUMPY
+    single_precision: bool = False
+    workers: int = 1
+    sequential_advection: bool = False
+    advection: Advection = Advection.SEMI_LAGRANGIAN
+    dt: float = 1.0  # simulated time per frame
+    # when positive, frames are split into substeps that move no cell more than cfl cells
+    cfl: float = 0.0
+    max_substeps: int = 8
+    # write the timing percentiles of every stage to this .json or .csv file at the end
+    profile: str = ""
+    profile_allocations: bool = False
+    # record every record_every-th step to this file (a directory for PNG), on a
+    # background thread that drops frames by record_policy when it falls behind
+    record: str = ""
+    record_format: RecordFormat = RecordFormat.RAW
+    record_every: int = 1
+    record_scale: int = 1
+    record_queue: int = 16
+    record_policy: DropPolicy = DropPolicy.DROP_OLDEST
+    # save the simulation to this directory every checkpoint_every steps and at the end
+    checkpoint: str = ""
+    checkpoint_every: int = 0
+    # continue from a checkpoint directory instead of the test scenario
+    restore: str = ""
+
+
+@dataclass
+class Args(SimulationArgs):
+    """Runs a test scenario without opening a window and saves the resulting fields."""
+
+    steps: int = 100
+    output: str = "fields.npz"
+
+
+def build_simulation(args) -> FluidSimulation:
+    """Sets up the simulation of the chosen test scenario with the options of args, or
+    restores the checkpoint of args.restore, with its own grid size and parameters."""
+    if args.restore:
+        return load_checkpoint(args.restore, backend=args.backend, workers=args.workers)
+    # note, that grid has 2 extra rows and columns, these are the boundaries
+    rows, cols = 2 + args.HEIGHT // args.cell_size, 2 + args.WIDTH // args.cell_size
+
+    diffuse_solver = SolverOptions(
+        args.diffuse_solver, args.solver_tol, args.solver_max_iter,
+        cycles=args.solver_cycles, omega=args.solver_omega, spectral=args.spectral,
+    )
+    pressure_solver = SolverOptions(
+        args.pressure_solver, args.solver_tol, args.solver_max_iter,
+        cycles=args.solver_cycles, omega=args.solver_omega, spectral=args.spectral,
+    )
+    return FluidSimulation.from_scenario(
+        args.test_scenario, rows, cols, diff=args.diff, visc=args.visc,
+        diffuse_solver=diffuse_solver, pressure_solver=pressure_solver,
+        backend=args.backend,
+        workers=args.workers,
+        sequential_advection=args.sequential_advection,
+        advection=args.advection,
+        dtype=np.float32 if args.single_precision else np.float64,
+    )
+
+
+def run_steps(sim: FluidSimulation, args, steps: int, on_step=None) -> int:
+    """Advances sim `steps` frames of args.dt, split into substeps by the CFL options of
+    args, and calls on_step(step) after every frame. Returns the substeps taken."""
+    control = CFLControl(args.cfl, args.max_substeps) if args.cfl > 0 else None
+    substeps = 0
+    for step in range(1, steps + 1):
+        substeps += sim.advance(args.dt, control)
+        if on_step is not None:
+            on_step(step)
+    return substeps
+
+
+def simulate(args) -> dict:
+    """Advances the chosen test scenario `args.steps` times as fast as possible.
+
+    :return dict of the final grid, u and v fields
+    """
+    sim = build_simulation(args)
+
+    recorder = None
+    if args.record:
+        recorder = FrameRecorder(
+            args.record, args.record_format, scale=args.record_scale,
+            queue_size=args.record_queue, policy=args.record_policy,
+        )
+        recorder.start()
+    checkpoints = CheckpointWriter(args.checkpoint) if args.checkpoint else None
+    # checkpoints count the steps since the test scenario started
+    start_steps = read_meta(args.restore)["steps"] if args.restore else 0
+
+    def on_step(step):
+        if recorder is not None and step % args.record_every == 0:
+            recorder.capture(packed_to_rgb(density_pixels(sim.grid)))
+        if (
+            checkpoints is not None
+            and args.checkpoint_every > 0
+            and step % args.checkpoint_every == 0
+        ):
+            checkpoints.save(sim, start_steps + step)
+
+    substeps = run_steps(sim, args, args.steps, on_step)
+
+    if recorder is not None:
+        recorder.stop()
+        print(
+            f"recorded {recorder.written} of {recorder.captured} frames, "
+            f"{recorder.dropped} dropped"
+        )
+    # after the recorder, so that a failed write does not lose the recording
+    if checkpoints is not None:
+        checkpoints.wait()
+        checkpoints.save(sim, start_steps + args.steps)
+        checkpoints.wait()
+
+    sim.close()
+    print(
+        f"last solves used {sim.diffuse_solver.iterations} diffuse and "
+        f"{sim.pressure_solver.iterations} pressure iterations, "
+        f"{substeps / args.steps:.2f} substeps per step on average"
+    )
+    return {"grid": sim.grid, "u": sim.u, "v": sim.v}
+
+
+def main(args):
+    if args.profile:
+        profiling.enable(args.profile_allocations)
+    t0 = time.perf_counter()
+    fields = simulate(args)
+    elapsed = time.perf_counter() - t0
+    if args.profile:
+        profiling.profiler.export(args.profile)
+        print(f"stage timings saved to {args.profile}")
+
+    np.savez(args.output, **fields)
+    rows, cols = fields["grid"].shape
+    print(
+        f"{args.steps} steps on a {rows}x{cols} grid in {elapsed:.2f}s "
+        f"({args.steps / elapsed:.1f} steps/s), saved to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    main(args)
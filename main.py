@@ -1,11 +1,16 @@
 import pygame as pg
 import pygame.freetype
-import numpy as np
 import time
 import tyro
+import profiling
 from dataclasses import dataclass
-from engine import add_source, GridDrawer, dense_step, vel_step, SolidsHandler
-import utils
+from checkpoint import CheckpointWriter, read_meta
+from engine import add_source, CFLControl
+from drawer import GridDrawer
+from headless import SimulationArgs, build_simulation
+from recorder import FrameRecorder
+from resolution import ResolutionController, resolution_levels
+from threaded import SimulationThread
 from enum import Enum
 from utils import (
     pos_to_index,
@@ -47,44 +52,93 @@ class DrawState:
                 else:
                     self.vis_type = VisType.DENS
 
+def paint_command(mode: DrawMode, pos, window, dt: float, cell_size):
+    """Returns the edit of the simulation that painting at the pixel pos makes in mode.
+    The pixel is mapped to a cell when the edit is applied, with the cell size that
+    cell_size returns for the grid shape of the simulation at that time."""
+
+    def command(sim):
+        j, i = pos_to_index(*pos, cell_size(sim.grid.shape[-2:]), *window)
+        if mode == DrawMode.SOURCE:
+            ui_source = circle_source(sim.grid, i, j, radius=5, weight=15)
+            add_source(sim.grid, ui_source, dt=dt)
+        elif mode == DrawMode.PLACE_SOLID:
+            sim.solids.add_solid(i, j, 3)
+        elif mode == DrawMode.ERASE_SOLID:
+            sim.solids.erase_solid(i, j, 3)
+
+    return command
+
+
 @dataclass
-class Args:
-    WIDTH: int = 1200
-    HEIGHT: int = 900
-    test_scenario: int = 1
-    cell_size: int = 10
-    diff: float = 1e-5
-    visc: float = 1e-4
+class Args(SimulationArgs):
+    """Runs a test scenario in a window, the mouse paints sources and solids."""
+
+    # step the simulation on a background thread, sim_rate times per second
+    threaded: bool = False
+    sim_rate: float = 60.0
+    # coarsen the simulation grid when the solver does not keep up with target_fps
+    # (sim_rate when threaded), and refine it again when there is headroom
+    adaptive_resolution: bool = False
+    target_fps: float = 60.0
     debug_print: bool = False
 
 
 def main(args):
     pygame.freetype.init()
+    if args.profile:
+        profiling.enable(args.profile_allocations)
 
     ### Setup
     # note, that grid has 2 extra rows and columns, these are the boundaries
     rows, cols = 2 + args.HEIGHT // args.cell_size, 2 + args.WIDTH // args.cell_size
-
-    grid, source, u_source, v_source, solids = utils.get_test_scenario(
-        args.test_scenario, rows, cols
-    )
-
-    u = np.zeros_like(grid)
-    v = np.zeros_like(grid)
+    levels = [(rows, cols, args.cell_size)]
+    if args.adaptive_resolution:
+        levels = resolution_levels(args.WIDTH, args.HEIGHT, args.cell_size)
+    cell_sizes = {(rows, cols): cs for rows, cols, cs in levels}
 
     screen = pg.display.set_mode((args.WIDTH, args.HEIGHT))
     pg.display.set_caption("Fluid simulation")
     font = pygame.freetype.SysFont("monospace", 26)
     grid_drawer = GridDrawer(rows, cols, args.cell_size)
-    solids_handler = SolidsHandler(solids)
+    sim = build_simulation(args)
+    # checkpoints count the steps since the test scenario started
+    start_steps = read_meta(args.restore)["steps"] if args.restore else 0
+    if sim.grid.shape != (rows, cols):
+        # a restored checkpoint keeps its own size, the window shows its own grid
+        sim.resample(rows, cols)
     draw_state = DrawState()
+    # the simulated time of a frame is fixed, independent of the frame rate
+    dt = args.dt
+    control = CFLControl(args.cfl, args.max_substeps) if args.cfl > 0 else None
+    runner = None
+    if args.threaded:
+        runner = SimulationThread(sim, dt, control, args.sim_rate)
+        runner.start()
+    resolution = None
+    if args.adaptive_resolution:
+        rate = args.sim_rate if args.threaded else args.target_fps
+        resolution = ResolutionController(
+            [(rows - 2) * (cols - 2) for rows, cols, _ in levels], budget=1 / rate
+        )
+    last_step = 0
+    recorder = None
+    if args.record:
+        recorder = FrameRecorder(
+            args.record, args.record_format, fps=args.sim_rate if args.threaded else 60,
+            scale=args.record_scale, queue_size=args.record_queue,
+            policy=args.record_policy,
+        )
+        recorder.start()
+    checkpoints = CheckpointWriter(args.checkpoint) if args.checkpoint else None
+    steps = 0
+    last_recorded, last_saved = 0, 0
 
     running = True
     clock = pg.time.Clock()
 
     while running:
         t0 = time.perf_counter()
-        dt = 1  # delta time should not be hardcoded
         mouse_x, mouse_y = pg.mouse.get_pos()
         for event in pg.event.get():
             if event.type == pg.QUIT:
@@ -98,29 +152,71 @@ def main(args):
         # UI input
         buttons = pg.mouse.get_pressed()
         if buttons[0]:  # left mouse button
-            mouse_j, mouse_i = pos_to_index(
-                mouse_x, mouse_y, args.cell_size, args.WIDTH, args.HEIGHT
+            command = paint_command(
+                draw_state.mode, (mouse_x, mouse_y), (args.WIDTH, args.HEIGHT), dt,
+                cell_sizes.get,
             )
-            if draw_state.mode == DrawMode.SOURCE:
-                ui_source = circle_source(grid, mouse_i, mouse_j, radius=5, weight=15)
-                add_source(grid, ui_source, dt=dt)
-            elif draw_state.mode == DrawMode.PLACE_SOLID:
-                solids_handler.add_solid(mouse_i, mouse_j, 3)
-            elif draw_state.mode == DrawMode.ERASE_SOLID:
-                solids_handler.erase_solid(mouse_i, mouse_j, 3)
+            if runner is not None:
+                runner.post(command)
+            else:
+                command(sim)
 
         # diff equation solver
         t1 = time.perf_counter()
-        u, v = vel_step(u, v, u_source, v_source, solids_handler, visc=args.visc, dt=dt)
-        t2 = time.perf_counter()
-        grid = dense_step(grid, source, u, v, solids_handler, diff=args.diff, dt=dt)
+        if runner is not None:
+            # the solver thread steps on its own, render whatever it finished last
+            fields = runner.latest()
+            stage_times, substeps = fields.stage_times, fields.substeps
+        else:
+            substeps = sim.advance(dt, control)
+            fields, stage_times = sim, sim.stage_times
+            steps += 1
         t3 = time.perf_counter()
-        if draw_state.vis_type == VisType.DENS:
-            grid_drawer.draw_grid(grid)
-        elif draw_state.vis_type == VisType.VEL:
-            grid_drawer.draw_velocity_field(u, v)
+        if fields.grid.shape != (grid_drawer.grid_height, grid_drawer.grid_width):
+            # the resolution changed, the drawer keeps the size on screen the same
+            rows, cols = fields.grid.shape
+            grid_drawer = GridDrawer(rows, cols, cell_sizes[rows, cols])
+        with profiling.span("render"):
+            if draw_state.vis_type == VisType.DENS:
+                grid_drawer.draw_grid(fields.grid)
+            elif draw_state.vis_type == VisType.VEL:
+                grid_drawer.draw_velocity_field(fields.u, fields.v)
 
         t4 = time.perf_counter()
+        if runner is not None:
+            steps = fields.steps
+        if recorder is not None:
+            if steps != last_recorded and steps % args.record_every == 0:
+                last_recorded = steps
+                # the surface holds the rendered image, one pixel per cell
+                recorder.capture(pg.surfarray.array3d(grid_drawer.surface).swapaxes(0, 1))
+        if (
+            checkpoints is not None
+            and args.checkpoint_every > 0
+            and steps - last_saved >= args.checkpoint_every
+        ):
+            last_saved = steps
+            # the arrays are copied between two steps, the files written in the background
+            command = lambda sim, n=start_steps + steps: checkpoints.save(sim, n)
+            if runner is not None:
+                runner.post(command)
+            else:
+                command(sim)
+        if resolution is not None:
+            level = None
+            if runner is None:
+                level = resolution.update(t4 - t0)
+            elif fields.steps != last_step:
+                # only the solver's own time counts, the render loop runs beside it
+                last_step = fields.steps
+                level = resolution.update(sum(stage_times.values()))
+            if level is not None:
+                rows, cols, _ = levels[level]
+                command = lambda sim, rows=rows, cols=cols: sim.resample(rows, cols)
+                if runner is not None:
+                    runner.post(command)
+                else:
+                    command(sim)
         # render fps counter on the screen
         fps = int(clock.get_fps())
         font.render_to(screen, (10, 10), f"FPS {fps}", (255, 255, 255))
@@ -136,14 +232,41 @@ def main(args):
                 )
 
             print_time("UI handle time", t1 - t0, 1)
-            print_time("vel_step time", t2 - t1, 2)
-            print_time("dense_step time", t3 - t2, 3)
+            print_time("vel_step time", stage_times.get("vel_step", 0.0), 2)
+            print_time("dense_step time", stage_times.get("dense_step", 0.0), 3)
             print_time("render time", t4 - t3, 4)
+            font.render_to(
+                screen,
+                (10, 10 + 5 * 30),
+                f"solver iters:   {sim.diffuse_solver.iterations} diffuse, {sim.pressure_solver.iterations} pressure",
+                (255, 255, 255),
+            )
+            font.render_to(
+                screen, (10, 10 + 6 * 30), f"substeps:       {substeps}", (255, 255, 255)
+            )
 
         pg.display.flip()
         clock.tick(120)
 
+    if runner is not None:
+        runner.stop()
+        steps = runner.latest().steps
+    sim.close()
     pg.quit()
+    if args.profile:
+        profiling.profiler.export(args.profile)
+    if recorder is not None:
+        recorder.stop()
+        print(
+            f"recorded {recorder.written} of {recorder.captured} frames, "
+            f"{recorder.dropped} dropped"
+        )
+    # last, so that a failed write does not lose the recording or the profile
+    if checkpoints is not None:
+        checkpoints.wait()
+        checkpoints.save(sim, start_steps + steps)
+        checkpoints.wait()
+        print(f"saved the simulation to {args.checkpoint}")
 
 
 if __name__ == "__main__":
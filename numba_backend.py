@@ -0,0 +1,194 @@
+"""Numba compiled, loop fused and multi-threaded equivalents of the NumPy kernels in engine.py.
+
+Numba is optional, when it is not installed `available` is False and FluidSimulation falls
+back to the NumPy implementation. The kernels are compiled on first use and cached on disk
+next to this file, so later runs do not pay for the compilation again.
+"""
+
+import numpy as np
+
+from engine import Flow
+
+try:
+    from numba import njit, prange
+
+    available = True
+except ImportError:
+    available = False
+
+
+if available:
+
+    @njit(cache=True, parallel=True)
+    def _apply(flat, solid_idx, neighbour_idx, weights):
+        """Sets every solid cell to the weighted sum of its neighbours, see SolidsHandler.apply"""
+        for k in prange(solid_idx.shape[0]):
+            value = 0.0
+            for d in range(4):
+                # zero weights belong to missing or solid neighbours, which may be written
+                # by other threads at the same time
+                if weights[d, k] != 0:
+                    value += flat[neighbour_idx[d, k]] * weights[d, k]
+            flat[solid_idx[k]] = value
+
+    @njit(cache=True, parallel=True)
+    def _jacobi_sweep(src, dst, rhs, a, c):
+        """dst = (rhs + a * (up + down + left + right)) / c on the interior"""
+        rows, cols = src.shape
+        for i in prange(1, rows - 1):
+            for j in range(1, cols - 1):
+                dst[i, j] = (
+                    rhs[i, j]
+                    + a * (src[i - 1, j] + src[i + 1, j] + src[i, j - 1] + src[i, j + 1])
+                ) / c
+
+    @njit(cache=True)
+    def _diffuse(grid, new_grid, spare, a, iterations, solid_idx, neighbour_idx, weights):
+        new_grid[:] = 0
+        spare[:] = 0
+        src, dst = new_grid, spare
+        for _ in range(iterations):
+            _jacobi_sweep(src, dst, grid, a, 1 + 4 * a)
+            src, dst = dst, src
+        if iterations % 2 == 1:
+            new_grid[:] = spare
+
+        _apply(new_grid.reshape(-1), solid_idx, neighbour_idx, weights)
+
+    @njit(cache=True, parallel=True)
+    def _advect(grid, new_grid, u, v, dt0):
+        rows, cols = grid.shape
+        new_grid[:] = grid
+        for i in prange(1, rows - 1):
+            for j in range(1, cols - 1):
+                x = min(max(i - dt0 * u[i, j], 0.5), rows - 0.5)
+                y = min(max(j - dt0 * v[i, j], 0.5), cols - 0.5)
+
+                i0 = int(x)
+                j0 = int(y)
+                # unlike NumPy fancy indexing there is no bounds check to rely on
+                i1 = min(i0 + 1, rows - 1)
+                j1 = min(j0 + 1, cols - 1)
+                s1 = x - i0
+                s0 = 1 - s1
+                t1 = y - j0
+                t0 = 1 - t1
+
+                new_grid[i, j] = s0 * (t0 * grid[i0, j0] + t1 * grid[i0, j1]) + s1 * (
+                    t0 * grid[i1, j0] + t1 * grid[i1, j1]
+                )
+
+    @njit(cache=True, parallel=True)
+    def _divergence(u, v, div, h):
+        rows, cols = div.shape
+        div[:] = 0
+        for i in prange(1, rows - 1):
+            for j in range(1, cols - 1):
+                div[i, j] = -0.5 * h * (u[i - 1, j] - u[i + 1, j] + v[i, j + 1] - v[i, j - 1])
+
+    @njit(cache=True, parallel=True)
+    def _subtract_gradient(u, v, p, h):
+        rows, cols = p.shape
+        for i in prange(1, rows - 1):
+            for j in range(1, cols - 1):
+                u[i, j] = u[i, j] - 0.5 * (p[i - 1, j] - p[i + 1, j]) / h
+                v[i, j] = v[i, j] - 0.5 * (p[i, j + 1] - p[i, j - 1]) / h
+
+    @njit(cache=True)
+    def _project(
+        u,
+        v,
+        div,
+        p,
+        spare,
+        iterations,
+        solid_idx,
+        neighbour_idx,
+        none_w,
+        vertical_w,
+        horizontal_w,
+    ):
+        rows, cols = div.shape
+        h = 1.0 / max(rows, cols)
+
+        _divergence(u, v, div, h)
+        p[:] = 0
+        spare[:] = 0
+        _apply(div.reshape(-1), solid_idx, neighbour_idx, none_w)
+        _apply(p.reshape(-1), solid_idx, neighbour_idx, none_w)
+
+        src, dst = p, spare
+        for _ in range(iterations):
+            _jacobi_sweep(src, dst, div, 1.0, 4.0)
+            _apply(dst.reshape(-1), solid_idx, neighbour_idx, none_w)
+            src, dst = dst, src
+        if iterations % 2 == 1:
+            p[:] = spare
+
+        _subtract_gradient(u, v, p, h)
+        _apply(u.reshape(-1), solid_idx, neighbour_idx, vertical_w)
+        _apply(v.reshape(-1), solid_idx, neighbour_idx, horizontal_w)
+
+
+def apply(grid: np.ndarray, boundary, flow) -> None:
+    """Same as SolidsHandler.apply, grid has to be C contiguous."""
+    _apply(grid.reshape(-1), *boundary.gather(flow))
+
+
+def diffuse(
+    grid: np.ndarray,
+    new_grid: np.ndarray,
+    spare: np.ndarray,
+    boundary,
+    flow,
+    diff: float,
+    dt: float,
+    iterations: int,
+) -> None:
+    """Same as engine.diffuse with the Jacobi solver, writes the result into new_grid.
+    spare is a scratch array of the same shape."""
+    rows, cols = grid.shape
+    a = dt * diff * rows * cols
+    _diffuse(grid, new_grid, spare, a, iterations, *boundary.gather(flow))
+
+
+def advect(
+    grid: np.ndarray,
+    new_grid: np.ndarray,
+    boundary,
+    flow,
+    u: np.ndarray,
+    v: np.ndarray,
+    dt: float,
+) -> None:
+    """Same as engine.advect, writes the result into new_grid."""
+    rows, cols = grid.shape
+    _advect(grid, new_grid, u, v, dt * rows)
+    apply(new_grid, boundary, flow)
+
+
+def project(
+    u: np.ndarray,
+    v: np.ndarray,
+    div: np.ndarray,
+    p: np.ndarray,
+    spare: np.ndarray,
+    boundary,
+    iterations: int,
+) -> None:
+    """Same as engine.project with the Jacobi solver, in place.
+    div, p and spare are scratch arrays of the same shape as u and v."""
+    solid_idx, neighbour_idx, none_w = boundary.gather(Flow.NONE)
+    _project(
+        u,
+        v,
+        div,
+        p,
+        spare,
+        iterations,
+        solid_idx,
+        neighbour_idx,
+        none_w,
+        boundary.gather(Flow.VERTICAL)[2],
+        boundary.gather(Flow.HORIZONTAL)[2],
+    )
@@ -0,0 +1,188 @@
+"""Named timing spans around the stages of the simulation and the rendering.
+
+The engine wraps every stage in `span(name)`. Spans opened inside other spans are
+recorded under the path of all of them, e.g. "vel_step/diffuse/apply", so the time of a
+stage can be told apart by where it was called from. For every path the profiler keeps
+the durations of the last `window` calls, from which it reports percentiles.
+
+Profiling is disabled by default, a disabled span is a shared no-op context manager,
+so the instrumentation costs a function call per stage. Enable it with `enable()`.
+"""
+
+import contextlib
+import csv
+import json
+import threading
+import time
+import tracemalloc
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import numpy as np
+
+
+class _Frame:
+    """An open span, with the allocation peak reached inside it before the last inner span
+    reset the peak of tracemalloc."""
+
+    __slots__ = ("path", "start", "memory", "child_peak")
+
+    def __init__(self, path: str, memory: int):
+        self.path = path
+        self.memory = memory
+        self.child_peak = 0
+        self.start = time.perf_counter()
+
+
+class Profiler:
+    """Collects the durations of the spans of every thread, see the module docstring.
+
+    With track_allocations the profiler also records how many bytes every span
+    allocated at its peak, on top of what was allocated when it was opened, using
+    tracemalloc. NumPy reports its array buffers to tracemalloc, so this covers the
+    temporaries of the NumPy kernels. Tracing slows every allocation down and its peak
+    is shared between threads, so it is meant for single-threaded runs.
+    """
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.enabled = False
+        self.track_allocations = False
+        self.durations: Dict[str, Deque[float]] = {}
+        self.counts: Dict[str, int] = {}
+        self.totals: Dict[str, float] = {}
+        self.allocations: Dict[str, Deque[int]] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    def enable(self, track_allocations: bool = False) -> None:
+        self.enabled = True
+        self.track_allocations = track_allocations
+        if track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def disable(self) -> None:
+        """Stops profiling, and tracemalloc if enable started it."""
+        self.enabled = False
+        self.track_allocations = False
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self.durations.clear()
+            self.counts.clear()
+            self.totals.clear()
+            self.allocations.clear()
+
+    def span(self, name: str):
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name)
+
+    @contextlib.contextmanager
+    def _span(self, name: str):
+        stack: Optional[List[_Frame]] = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        path = f"{stack[-1].path}/{name}" if stack else name
+        memory = 0
+        if self.track_allocations:
+            memory, peak = tracemalloc.get_traced_memory()
+            if stack:
+                # the reset below drops the peak the outer span reached so far
+                stack[-1].child_peak = max(stack[-1].child_peak, peak)
+            tracemalloc.reset_peak()
+        frame = _Frame(path, memory)
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - frame.start
+            stack.pop()
+            allocated = None
+            if self.track_allocations:
+                # the inner spans folded the peaks their reset_peak dropped into child_peak
+                peak = max(tracemalloc.get_traced_memory()[1], frame.child_peak)
+                allocated = max(peak - frame.memory, 0)
+                if stack:
+                    stack[-1].child_peak = max(stack[-1].child_peak, peak)
+            self._record(path, elapsed, allocated)
+
+    def _record(self, path: str, elapsed: float, allocated: Optional[int]) -> None:
+        with self._lock:
+            durations = self.durations.get(path)
+            if durations is None:
+                durations = self.durations[path] = deque(maxlen=self.window)
+                self.allocations[path] = deque(maxlen=self.window)
+                self.counts[path] = 0
+                self.totals[path] = 0.0
+            durations.append(elapsed)
+            self.counts[path] += 1
+            self.totals[path] += elapsed
+            if allocated is not None:
+                self.allocations[path].append(allocated)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Returns for every span path its number of calls and total seconds, and the
+        mean and percentiles of the seconds and allocated bytes of the last window calls."""
+        with self._lock:
+            paths = sorted(self.durations)
+            durations = {path: np.array(self.durations[path]) for path in paths}
+            allocations = {path: np.array(self.allocations[path]) for path in paths}
+            counts, totals = dict(self.counts), dict(self.totals)
+
+        result = {}
+        for path in paths:
+            p50, p95, p99 = np.percentile(durations[path], (50, 95, 99))
+            stats = {
+                "count": counts[path],
+                "total": totals[path],
+                "mean": float(durations[path].mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+            }
+            if len(allocations[path]):
+                stats["alloc_mean"] = float(allocations[path].mean())
+                stats["alloc_max"] = int(allocations[path].max())
+            result[path] = stats
+        return result
+
+    def to_json(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def to_csv(self, path: str) -> None:
+        summary = self.summary()
+        columns = ["count", "total", "mean", "p50", "p95", "p99", "alloc_mean", "alloc_max"]
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["span", *columns])
+            for name, stats in summary.items():
+                writer.writerow([name, *(stats.get(column, "") for column in columns)])
+
+    def export(self, path: str) -> None:
+        """Writes the summary to path, as CSV if it ends in .csv, otherwise as JSON."""
+        if path.endswith(".csv"):
+            self.to_csv(path)
+        else:
+            self.to_json(path)
+
+
+_NULL_SPAN = contextlib.nullcontext()
+
+# the profiler the engine reports to
+profiler = Profiler()
+
+
+def span(name: str):
+    """Returns a context manager that times its body as the span name."""
+    return profiler.span(name)
+
+
+def enable(track_allocations: bool = False) -> None:
+    profiler.enable(track_allocations)
@@ -0,0 +1,191 @@
+"""Records the rendered frames of a simulation on a background writer thread.
+
+The simulation loop hands every captured frame to the writer through a bounded queue
+and never waits for it. When the writer falls behind and the queue is full, frames are
+dropped according to the DropPolicy instead of stalling the loop.
+"""
+
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import warnings
+from enum import Enum
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class RecordFormat(Enum):
+    RAW = 0  # one file of rgb24 frames, e.g. for ffmpeg -f rawvideo
+    PNG = 1  # a directory of numbered PNG images
+    FFMPEG = 2  # a video encoded by an ffmpeg process, falls back to RAW without ffmpeg
+
+
+class DropPolicy(Enum):
+    DROP_NEWEST = 0  # keep the queued frames, drop the one being captured
+    DROP_OLDEST = 1  # drop the oldest queued frame to make room for the new one
+
+
+def packed_to_rgb(pixels: np.ndarray) -> np.ndarray:
+    """Returns the (h, w, 3) uint8 image of packed 0xRRGGBB pixels."""
+    rgb = np.empty(pixels.shape + (3,), dtype=np.uint8)
+    rgb[..., 0] = pixels >> 16
+    rgb[..., 1] = pixels >> 8
+    rgb[..., 2] = pixels
+    return rgb
+
+
+def fit_frame(frame: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """Returns frame resized to shape by repeating its nearest pixels."""
+    if frame.shape[:2] == shape:
+        return frame
+    i = np.arange(shape[0]) * frame.shape[0] // shape[0]
+    j = np.arange(shape[1]) * frame.shape[1] // shape[1]
+    return frame[i[:, None], j[None, :]]
+
+
+class FrameRecorder:
+    """Writes the frames passed to `capture` to path in the given format.
+
+    Every frame is an (h, w, 3) uint8 RGB image, it is scaled up by `scale` on the
+    writer thread. A stream has a single frame size, so frames of a different size, e.g.
+    after the resolution of the simulation changed, are resized to the first one.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fmt: RecordFormat = RecordFormat.RAW,
+        fps: float = 30.0,
+        scale: int = 1,
+        queue_size: int = 16,
+        policy: DropPolicy = DropPolicy.DROP_OLDEST,
+    ):
+        if fmt == RecordFormat.FFMPEG and shutil.which("ffmpeg") is None:
+            warnings.warn("ffmpeg was not found, recording raw rgb24 frames instead")
+            fmt = RecordFormat.RAW
+        self.path = path
+        self.fmt = fmt
+        self.fps = fps
+        self.scale = scale
+        self.policy = policy
+        self.captured = 0
+        self.dropped = 0
+        self.written = 0
+        self.shape: Optional[Tuple[int, int]] = None
+        self.error: Optional[BaseException] = None
+        self._queue: "queue.Queue[Optional[np.ndarray]]" = queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._file = None
+        self._process: Optional[subprocess.Popen] = None
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def capture(self, frame: np.ndarray) -> None:
+        """Queues frame for writing without waiting, the caller must not change it
+        afterwards. Drops a frame when the queue is full."""
+        if self.error is not None:
+            raise RuntimeError("The recorder thread stopped") from self.error
+        self.captured += 1
+        try:
+            self._queue.put_nowait(frame)
+            return
+        except queue.Full:
+            pass
+
+        self.dropped += 1
+        if self.policy == DropPolicy.DROP_NEWEST:
+            return
+        elif self.policy == DropPolicy.DROP_OLDEST:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass  # the writer took it in the meantime
+            try:
+                self._queue.put_nowait(frame)
+            except queue.Full:
+                pass  # only one producer, so this does not happen
+        else:
+            raise Exception(f"Drop policy: Invalid enum item '{self.policy}'")
+
+    def stop(self) -> None:
+        """Writes the queued frames, then closes the output. Raises the error the writer
+        thread stopped with."""
+        while self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass  # the writer is still busy, or stopped on an error
+        self._thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"Recording to {self.path} failed") from self.error
+
+    def _run(self) -> None:
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is None:
+                    break
+                self._write(frame)
+                self.written += 1
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._close()
+
+    def _write(self, frame: np.ndarray) -> None:
+        if self.scale > 1:
+            frame = frame.repeat(self.scale, axis=0).repeat(self.scale, axis=1)
+        if self.shape is None:
+            self.shape = frame.shape[:2]
+            self._open()
+        frame = np.ascontiguousarray(fit_frame(frame, self.shape))
+
+        if self.fmt == RecordFormat.RAW:
+            self._file.write(frame.tobytes())
+        elif self.fmt == RecordFormat.PNG:
+            import pygame as pg
+
+            surface = pg.surfarray.make_surface(frame.swapaxes(0, 1))
+            name = f"frame_{self.written:06d}.png"
+            pg.image.save(surface, os.path.join(self.path, name))
+        elif self.fmt == RecordFormat.FFMPEG:
+            self._process.stdin.write(frame.tobytes())
+        else:
+            raise Exception(f"Record format: Invalid enum item '{self.fmt}'")
+
+    def _open(self) -> None:
+        height, width = self.shape
+        if self.fmt == RecordFormat.RAW:
+            self._file = open(self.path, "wb")
+            print(
+                f"recording rgb24 {width}x{height} frames to {self.path}, play with: "
+                f"ffplay -f rawvideo -pixel_format rgb24 -video_size {width}x{height} "
+                f"-framerate {self.fps:g} {self.path}"
+            )
+        elif self.fmt == RecordFormat.PNG:
+            os.makedirs(self.path, exist_ok=True)
+        elif self.fmt == RecordFormat.FFMPEG:
+            self._process = subprocess.Popen(
+                [
+                    "ffmpeg", "-y", "-loglevel", "error",
+                    "-f", "rawvideo", "-pixel_format", "rgb24",
+                    "-video_size", f"{width}x{height}", "-framerate", f"{self.fps:g}",
+                    "-i", "-",
+                    # most players need an even size for yuv420p
+                    "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p",
+                    self.path,
+                ],
+                stdin=subprocess.PIPE,
+            )
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process.wait()
@@ -0,0 +1,74 @@
+"""Picks the simulation resolution at runtime from the measured time of the solver.
+
+The interactive loop renders the interior of the grid scaled up to the window, so the
+resolution of the simulation can change without the window changing size. When the
+solver does not fit into the frame budget any more the simulation moves to a coarser
+grid, and once it would fit with room to spare it moves back to a finer one.
+"""
+
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+
+def resolution_levels(
+    width: int,
+    height: int,
+    cell_size: int,
+    factors: Sequence[float] = (1, 1.25, 1.5, 2, 2.5, 3, 4),
+) -> List[Tuple[int, int, int]]:
+    """Returns the (rows, cols, cell size) of every level, finest first. The cell size of
+    a level is cell_size scaled by one of the factors, in whole pixels."""
+    levels = []
+    for factor in factors:
+        cs = max(1, round(cell_size * factor))
+        level = (2 + height // cs, 2 + width // cs, cs)
+        if level not in levels and level[0] > 2 and level[1] > 2:
+            levels.append(level)
+    return levels
+
+
+@dataclass
+class ResolutionController:
+    """Chooses a level from the solver time of every frame.
+
+    cells holds the number of cells of every level, finest first. The time is smoothed
+    with an exponential moving average, so a single slow frame does not change the
+    level. The level gets coarser when the average exceeds the budget, and finer when the
+    average scaled to the finer level's number of cells stays below headroom * budget.
+    After a change the controller waits `patience` frames before it changes again.
+    """
+
+    cells: Sequence[int]
+    budget: float
+    level: int = 0
+    headroom: float = 0.7
+    smoothing: float = 0.1
+    patience: int = 10
+    _average: Optional[float] = field(default=None, init=False)
+    _frames: int = field(default=0, init=False)
+
+    def update(self, work_time: float) -> Optional[int]:
+        """Records the solver time of a frame, returns the new level when it changes."""
+        if self._average is None:
+            self._average = work_time
+        else:
+            self._average += self.smoothing * (work_time - self._average)
+        self._frames += 1
+        if self._frames < self.patience:
+            return None
+
+        level = self.level
+        if self._average > self.budget and level + 1 < len(self.cells):
+            level += 1
+        elif level > 0:
+            # the solver time grows about linearly with the number of cells
+            finer = self._average * self.cells[level - 1] / self.cells[level]
+            if finer < self.budget * self.headroom:
+                level -= 1
+        if level == self.level:
+            return None
+
+        self.level = level
+        self._average = None
+        self._frames = 0
+        return level
@@ -0,0 +1,172 @@
+import dataclasses
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Tuple
+
+import numpy as np
+import tyro
+from numpy.lib.format import open_memmap
+
+import headless
+
+
+@dataclass
+class Args:
+    """Runs every combination of the listed test scenarios, diffusions, viscosities, cell
+    sizes and step counts headless on a process pool.
+
+    Each configuration writes its final fields, and every `sample_every` steps a sample
+    of them, into memory-mapped .npy files under output_dir/<key>/. Finished configurations
+    are recorded in output_dir/index.jsonl and skipped when the sweep is run again.
+    """
+
+    test_scenarios: Tuple[int, ...] = (1,)
+    diffs: Tuple[float, ...] = (1e-5,)
+    viscs: Tuple[float, ...] = (1e-4,)
+    cell_sizes: Tuple[int, ...] = (10,)
+    steps: Tuple[int, ...] = (100,)
+    sample_every: int = 0
+    processes: int = os.cpu_count() or 1
+    seed: int = 0
+    output_dir: str = "sweep"
+    # every other option of a single run, e.g. --simulation.pressure-solver CG
+    simulation: headless.Args = field(default_factory=headless.Args)
+
+
+def configurations(args) -> list:
+    """Returns the headless arguments of every configuration of the sweep."""
+    return [
+        dataclasses.replace(
+            args.simulation,
+            test_scenario=test_scenario,
+            diff=diff,
+            visc=visc,
+            cell_size=cell_size,
+            steps=steps,
+        )
+        for test_scenario, diff, visc, cell_size, steps in itertools.product(
+            args.test_scenarios, args.diffs, args.viscs, args.cell_sizes, args.steps
+        )
+    ]
+
+
+def config_key(config: headless.Args, seed: int) -> str:
+    """Returns a readable name of the configuration, followed by a digest of all of its
+    options, so that changing any option makes it a new configuration."""
+    options = json.dumps(
+        {**dataclasses.asdict(config), "seed": seed}, sort_keys=True, default=str
+    )
+    digest = hashlib.sha1(options.encode()).hexdigest()[:10]
+    return (
+        f"scenario{config.test_scenario}_diff{config.diff:g}_visc{config.visc:g}"
+        f"_cell{config.cell_size}_steps{config.steps}_{digest}"
+    )
+
+
+def load_index(path: str) -> set:
+    """Returns the keys of the configurations recorded as finished in the index."""
+    if not os.path.exists(path):
+        return set()
+    with open(path) as index:
+        return {json.loads(line)["key"] for line in index if line.strip()}
+
+
+def run(config: headless.Args, key: str, directory: str, sample_every: int, seed: int) -> dict:
+    """Runs one configuration in a worker process. The fields are written straight into
+    memory-mapped .npy files, only the small index entry is sent back to the parent."""
+    np.random.seed(seed)  # some test scenarios start from random noise
+    sim = headless.build_simulation(config)
+    rows, cols = sim.grid.shape
+    path = os.path.join(directory, key)
+    os.makedirs(path, exist_ok=True)
+
+    samples = None
+    if sample_every > 0:
+        samples = open_memmap(
+            os.path.join(path, "samples.npy"),
+            mode="w+",
+            dtype=sim.grid.dtype,
+            shape=(config.steps // sample_every, 3, rows, cols),
+        )
+
+    def on_step(step):
+        if samples is not None and step % sample_every == 0:
+            sample = samples[step // sample_every - 1]
+            sample[0], sample[1], sample[2] = sim.grid, sim.u, sim.v
+
+    # the same frames of config.dt, and CFL substeps, as a headless run
+    t0 = time.perf_counter()
+    headless.run_steps(sim, config, config.steps, on_step)
+    elapsed = time.perf_counter() - t0
+    sim.close()
+
+    if samples is not None:
+        samples.flush()
+    for name, values in (("grid", sim.grid), ("u", sim.u), ("v", sim.v)):
+        out = open_memmap(
+            os.path.join(path, f"{name}.npy"),
+            mode="w+",
+            dtype=values.dtype,
+            shape=values.shape,
+        )
+        out[...] = values
+        out.flush()
+
+    return {
+        "key": key,
+        "options": json.loads(json.dumps(dataclasses.asdict(config), default=str)),
+        "seed": seed,
+        "rows": rows,
+        "cols": cols,
+        "samples": 0 if samples is None else len(samples),
+        "elapsed": elapsed,
+    }
+
+
+def main(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    index_path = os.path.join(args.output_dir, "index.jsonl")
+    finished = load_index(index_path)
+
+    configs = configurations(args)
+    todo = [
+        (config, key)
+        for config in configs
+        if (key := config_key(config, args.seed)) not in finished
+    ]
+    print(f"{len(configs) - len(todo)} of {len(configs)} configurations already finished")
+
+    t0 = time.perf_counter()
+    failed = 0
+    # only the parent appends to the index, after a configuration's files are complete,
+    # so an interrupted sweep simply reruns the configurations that are missing from it
+    with ProcessPoolExecutor(args.processes) as pool, open(index_path, "a") as index:
+        futures = {
+            pool.submit(run, config, key, args.output_dir, args.sample_every, args.seed): key
+            for config, key in todo
+        }
+        for future in as_completed(futures):
+            try:
+                entry = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"{futures[future]} failed: {e!r}")
+                continue
+            index.write(json.dumps(entry) + "\n")
+            index.flush()
+            print(f"{entry['key']} finished in {entry['elapsed']:.2f}s")
+
+    print(
+        f"{len(todo) - failed} configurations finished, {failed} failed, "
+        f"in {time.perf_counter() - t0:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    main(args)
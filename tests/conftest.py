@@ -0,0 +1,43 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# the modules of the simulation live in the repository root, next to main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import FluidSimulation  # noqa: E402
+
+FIELDS = ("grid", "u", "v")
+
+
+@pytest.fixture
+def run():
+    """Returns a function that advances a test scenario `steps` frames with the given
+    constructor arguments, and returns the closed simulation."""
+
+    def run(scenario=5, rows=34, cols=42, steps=5, **kwargs):
+        np.random.seed(0)  # some test scenarios start from random noise
+        kwargs = {"diff": 1e-5, "visc": 1e-4, **kwargs}
+        with FluidSimulation.from_scenario(scenario, rows, cols, **kwargs) as sim:
+            for _ in range(steps):
+                sim.step(1)
+        return sim
+
+    return run
+
+
+@pytest.fixture
+def assert_same_fields():
+    """Returns a function that checks that the fields of two simulations agree, exactly
+    unless tolerances are given."""
+
+    def check(actual, expected, rtol=0.0, atol=0.0):
+        for name in FIELDS:
+            np.testing.assert_allclose(
+                getattr(actual, name), getattr(expected, name), rtol=rtol, atol=atol,
+                err_msg=name,
+            )
+
+    return check
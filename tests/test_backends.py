@@ -0,0 +1,32 @@
+import pytest
+
+import numba_backend
+from engine import Backend, RowBands, Solver, SolverOptions
+
+
+@pytest.mark.skipif(not numba_backend.available, reason="Numba is not installed")
+@pytest.mark.parametrize("scenario", [1, 5])
+def test_numba_matches_numpy(run, assert_same_fields, scenario):
+    numba = run(scenario, backend=Backend.NUMBA)
+    assert numba.backend == Backend.NUMBA
+    assert_same_fields(numba, run(scenario), rtol=1e-9, atol=1e-12)
+
+
+def test_row_bands_cover_every_row_once():
+    bands = RowBands(3)
+    covered = []
+    bands.run(lambda start, stop: covered.extend(range(start, stop)), 200)
+    assert sorted(covered) == list(range(200))
+    bands.close()
+    # after close the rows are updated on the calling thread
+    covered.clear()
+    bands.run(lambda start, stop: covered.append((start, stop)), 200)
+    assert covered == [(0, 200)]
+
+
+@pytest.mark.parametrize("solver", [Solver.JACOBI, Solver.CG])
+def test_row_bands_match_single_thread(run, assert_same_fields, solver):
+    # enough rows for two bands of RowBands.min_band_rows
+    options = dict(diffuse_solver=SolverOptions(solver), pressure_solver=SolverOptions(solver))
+    banded = run(rows=130, cols=50, workers=2, **options)
+    assert_same_fields(banded, run(rows=130, cols=50, **options))
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+import benchmark
+
+
+def test_compare_flags_only_regressions_beyond_threshold():
+    baseline = {"a": {"min": 1.0}, "b": {"min": 1.0}, "gone": {"min": 1.0}}
+    results = {"a": {"min": 1.2}, "b": {"min": 1.3}, "new": {"min": 9.0}}
+    assert benchmark.compare(results, baseline, threshold=0.25) == ["b"]
+
+
+def test_saved_baseline_round_trip(tmp_path):
+    args = benchmark.Args(
+        kernels=("diffuse", "apply"), test_scenarios=(5,), sizes=(8, 16),
+        dtypes=("float32",), repeats=2, warmup=0, settle_steps=1,
+        baseline=str(tmp_path / "baseline.json"), save=True,
+    )
+    benchmark.main(args)
+    with open(args.baseline) as f:
+        saved = json.load(f)["results"]
+    assert sorted(saved) == [
+        "apply/scenario5/16/float32", "apply/scenario5/8/float32",
+        "diffuse/scenario5/16/float32", "diffuse/scenario5/8/float32",
+    ]
+    assert saved["diffuse/scenario5/16/float32"]["cells"] == 256
+
+    # against a baseline ten times faster the run fails
+    faster = {key: {**result, "min": result["min"] / 10} for key, result in saved.items()}
+    with open(args.baseline, "w") as f:
+        json.dump({"results": faster}, f)
+    with pytest.raises(SystemExit):
+        benchmark.main(benchmark.Args(**{**vars(args), "save": False}))
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from checkpoint import (
+    FIELDS,
+    CheckpointWriter,
+    load_checkpoint,
+    read_meta,
+    save_checkpoint,
+)
+from engine import Advection, Solver, SolverOptions
+
+
+@pytest.fixture
+def saved(run, tmp_path):
+    """A simulation after a few frames, and the path of its checkpoint."""
+    sim = run(
+        diff=2e-5, visc=3e-4, steps=3, advection=Advection.MACCORMACK,
+        pressure_solver=SolverOptions(Solver.CG, tol=1e-4, max_iter=50),
+    )
+    path = str(tmp_path / "checkpoint")
+    save_checkpoint(sim, path, steps=3)
+    return sim, path
+
+
+def test_round_trip(saved, assert_same_fields):
+    sim, path = saved
+    restored = load_checkpoint(path)
+    assert read_meta(path)["steps"] == 3
+    for name in FIELDS:
+        np.testing.assert_array_equal(getattr(restored, name), getattr(sim, name), name)
+    np.testing.assert_array_equal(restored.solids.bound, sim.solids.bound)
+    assert (restored.diff, restored.visc) == (sim.diff, sim.visc)
+    assert (restored.pressure_solver.solver, restored.pressure_solver.tol) == (
+        Solver.CG, 1e-4
+    )
+    assert restored.advection == Advection.MACCORMACK
+
+    # the restored simulation continues exactly like the saved one, copy on write
+    # leaves the files as they were saved
+    grid = sim.grid.copy()
+    sim.step(1)
+    restored.step(1)
+    assert_same_fields(restored, sim)
+    np.testing.assert_array_equal(np.load(os.path.join(path, "grid.npy")), grid)
+
+
+def test_restores_the_old_checkpoint_after_a_crash(saved):
+    sim, path = saved
+    # a crash after the old checkpoint was moved away, before the new one moved in
+    os.replace(path, f"{path}.old")
+
+    assert read_meta(path)["steps"] == 3
+    np.testing.assert_array_equal(load_checkpoint(path).grid, sim.grid)
+    save_checkpoint(sim, path, steps=4)
+    assert read_meta(path)["steps"] == 4
+    assert not os.path.exists(f"{path}.old")
+
+
+def test_writer_raises_failed_writes(run, tmp_path):
+    sim = run(steps=1)
+    # a file where the checkpoint directory has to go makes every write fail
+    blocked = tmp_path / "blocked"
+    blocked.write_text("")
+    writer = CheckpointWriter(str(blocked / "checkpoint"))
+    assert writer.save(sim)
+    with pytest.raises(RuntimeError):
+        writer.wait()
+    with pytest.raises(RuntimeError):
+        writer.save(sim)
+    assert writer.saved == 0
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from engine import FluidSimulation, Solver, SolverOptions
+
+
+@pytest.mark.parametrize("solver", [Solver.JACOBI, Solver.CG])
+def test_ensemble_matches_separate_runs(run, solver):
+    scenarios, diffs, viscs = [1, 3], np.array([1e-5, 1e-4]), np.array([1e-4, 3e-4])
+    options = dict(
+        diffuse_solver=SolverOptions(solver), pressure_solver=SolverOptions(solver)
+    )
+    np.random.seed(0)
+    with FluidSimulation.from_scenarios(
+        scenarios, 34, 42, diff=diffs, visc=viscs, **options
+    ) as ensemble:
+        for _ in range(5):
+            ensemble.step(1)
+
+    for k, scenario in enumerate(scenarios):
+        member = run(scenario, diff=diffs[k], visc=viscs[k], **options)
+        for name in ("grid", "u", "v"):
+            np.testing.assert_allclose(
+                getattr(ensemble, name)[k], getattr(member, name), rtol=1e-9,
+                atol=1e-12, err_msg=f"{name} of member {k}",
+            )
+
+
+def test_ensemble_members_share_solids():
+    with pytest.raises(ValueError):
+        FluidSimulation.from_scenarios([1, 5], 34, 42, diff=1e-5, visc=1e-4)
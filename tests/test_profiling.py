@@ -0,0 +1,87 @@
+import csv
+import json
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import profiling
+from profiling import Profiler
+
+
+def test_nested_spans_keep_the_outer_peak():
+    profiler = Profiler()
+    profiler.enable(track_allocations=True)
+    try:
+        with profiler.span("outer"):
+            transient = np.ones(1 << 20)  # 8 MB, freed before the inner span opens
+            del transient
+            with profiler.span("inner"):
+                inner = np.ones(1 << 17)  # 1 MB
+                del inner
+    finally:
+        profiler.disable()
+    summary = profiler.summary()
+    assert summary["outer"]["alloc_max"] >= 8 << 20
+    assert 1 << 20 <= summary["outer/inner"]["alloc_max"] < 8 << 20
+    assert not tracemalloc.is_tracing()
+
+
+def test_disable_keeps_tracing_started_elsewhere():
+    tracemalloc.start()
+    try:
+        profiler = Profiler()
+        profiler.enable(track_allocations=True)
+        profiler.disable()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+
+@pytest.fixture
+def timed(monkeypatch):
+    """A profiler whose span "outer" took 1, 2, ... 100 seconds, each time around a span
+    "inner" of half a second."""
+    ticks, now = [], 0.0
+    for duration in range(1, 101):
+        # the clock reads of opening outer and inner, closing inner and outer
+        ticks += [now, now, now + 0.5, now + duration]
+        now += duration
+    monkeypatch.setattr(profiling.time, "perf_counter", iter(ticks).__next__)
+    profiler = Profiler(window=50)
+    profiler.enable()
+    for _ in range(100):
+        with profiler.span("outer"):
+            with profiler.span("inner"):
+                pass
+    profiler.disable()
+    return profiler
+
+
+def test_percentiles_of_the_window(timed):
+    summary = timed.summary()
+    assert sorted(summary) == ["outer", "outer/inner"]
+    outer = summary["outer"]
+    assert outer["count"] == 100
+    assert outer["total"] == pytest.approx(5050)
+    # the percentiles only cover the last 50 calls, of 51 to 100 seconds
+    assert outer["mean"] == pytest.approx(75.5)
+    assert outer["p50"] == pytest.approx(75.5)
+    assert outer["p95"] == pytest.approx(97.55)
+    assert outer["p99"] == pytest.approx(99.51)
+    assert summary["outer/inner"]["p99"] == pytest.approx(0.5)
+    assert "alloc_max" not in outer
+
+
+def test_export(timed, tmp_path):
+    timed.export(str(tmp_path / "stages.json"))
+    with open(tmp_path / "stages.json") as f:
+        assert json.load(f) == timed.summary()
+
+    timed.export(str(tmp_path / "stages.csv"))
+    with open(tmp_path / "stages.csv", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["span"] for row in rows] == ["outer", "outer/inner"]
+    assert float(rows[0]["p50"]) == pytest.approx(75.5)
+    assert rows[0]["alloc_max"] == ""
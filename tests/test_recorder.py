@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from recorder import DropPolicy, FrameRecorder, RecordFormat
+
+
+def frame(value, shape=(4, 6)):
+    return np.full(shape + (3,), value, dtype=np.uint8)
+
+
+def test_stop_raises_write_errors(tmp_path):
+    # a raw file can not be opened inside a missing directory
+    recorder = FrameRecorder(str(tmp_path / "missing" / "out.raw"), RecordFormat.RAW)
+    recorder.start()
+    recorder.capture(frame(1))
+    with pytest.raises(RuntimeError):
+        recorder.stop()
+    assert recorder.written == 0
+
+
+@pytest.mark.parametrize(
+    "policy, kept", [(DropPolicy.DROP_NEWEST, [0, 1]), (DropPolicy.DROP_OLDEST, [3, 4])]
+)
+def test_drop_policies(tmp_path, policy, kept):
+    path = tmp_path / "out.raw"
+    recorder = FrameRecorder(str(path), RecordFormat.RAW, queue_size=2, policy=policy)
+    # the writer is not started yet, so the queue fills up
+    for value in range(5):
+        recorder.capture(frame(value))
+    recorder.start()
+    recorder.stop()
+
+    assert (recorder.captured, recorder.dropped, recorder.written) == (5, 3, 2)
+    frames = np.fromfile(path, dtype=np.uint8).reshape(-1, 4, 6, 3)
+    assert [int(f[0, 0, 0]) for f in frames] == kept
+
+
+def test_frames_are_scaled_and_fit_the_first(tmp_path):
+    path = tmp_path / "out.raw"
+    recorder = FrameRecorder(str(path), RecordFormat.RAW, scale=2)
+    recorder.start()
+    recorder.capture(frame(1))
+    recorder.capture(frame(2, shape=(2, 3)))  # e.g. after a resolution change
+    recorder.stop()
+    frames = np.fromfile(path, dtype=np.uint8).reshape(-1, 8, 12, 3)
+    assert [int(f.min()) for f in frames] == [1, 2]
+    assert [int(f.max()) for f in frames] == [1, 2]
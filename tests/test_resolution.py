@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from resolution import ResolutionController, resolution_levels
+
+
+def feed(controller, work_time, frames):
+    """Feeds `frames` frames of work_time to controller, returns the (frame, level) of
+    every change it reported."""
+    changes = [(frame, controller.update(work_time)) for frame in range(frames)]
+    return [(frame, level) for frame, level in changes if level is not None]
+
+
+def test_levels_coarsen_from_the_cell_size():
+    levels = resolution_levels(1200, 900, 10)
+    assert levels[0] == (92, 122, 10)
+    assert [cs for _, _, cs in levels] == sorted({cs for _, _, cs in levels})
+
+
+def test_controller_has_hysteresis():
+    controller = ResolutionController([400, 200, 100], budget=1.0, patience=5)
+    # a single slow frame among fast ones is smoothed away
+    assert feed(controller, 0.5, 4) + feed(controller, 3.0, 1) == []
+    assert feed(controller, 0.5, 20) == []
+
+    # a sustained overrun coarsens one level at a time, patience frames apart
+    changes = feed(controller, 2.0, 30)
+    assert [level for _, level in changes] == [1, 2]
+    assert changes[1][0] - changes[0][0] >= controller.patience
+    # the finer level would take 2 * 0.45 = 0.9, over headroom * budget, so it stays
+    assert feed(controller, 0.45, 50) == []
+    # with enough headroom it refines again
+    changes = feed(controller, 0.1, 30)
+    assert [level for _, level in changes] == [1, 0]
+    assert changes[1][0] - changes[0][0] >= controller.patience
+
+
+def test_resample_round_trip_keeps_sources_and_solids(run):
+    sim = run(steps=2)
+    source, bound = sim.source.copy(), sim.solids.bound.copy()
+    for rows, cols in [(18, 22), (12, 15), (34, 42), (18, 22)]:
+        sim.resample(rows, cols)
+        assert sim.grid.shape == sim.u.shape == sim.solids.bound.shape == (rows, cols)
+        # the same total source over the domain, at every resolution
+        assert sim.source[1:-1, 1:-1].mean() == pytest.approx(source[1:-1, 1:-1].mean())
+        sim.step(1)
+    sim.resample(34, 42)
+    np.testing.assert_array_equal(sim.source[1:-1, 1:-1], source[1:-1, 1:-1])
+    np.testing.assert_array_equal(sim.solids.bound, bound)
+
+
+def test_resample_keeps_painted_solids(run):
+    sim = run(steps=0)
+    sim.resample(18, 22)
+    sim.solids.add_solid(9, 11, 2)
+    painted = sim.solids.bound.copy()
+    sim.resample(34, 42)
+    sim.resample(18, 22)
+    np.testing.assert_array_equal(sim.solids.bound, painted)
@@ -0,0 +1,27 @@
+import numpy as np
+
+from engine import Flow, SolidsHandler
+from utils import get_test_scenario
+
+
+def test_painted_cache_matches_rebuild():
+    rng = np.random.default_rng(0)
+    solids = SolidsHandler(get_test_scenario(5, 40, 50)[-1])
+    for _ in range(50):
+        i, j = rng.integers(-3, 53, size=2)
+        size = int(rng.integers(0, 5))
+        if rng.random() < 0.5:
+            solids.add_solid(i, j, size)
+        else:
+            solids.erase_solid(i, j, size)
+
+    rebuilt = SolidsHandler(solids.bound.copy())
+    for name in ("mask", "mask_neg", "cnt", "left", "right", "up", "down"):
+        np.testing.assert_array_equal(getattr(solids, name), getattr(rebuilt, name), name)
+    assert solids.box_only == rebuilt.box_only
+    grid = rng.standard_normal(solids.bound.shape)
+    for flow in Flow:
+        painted, fresh = grid.copy(), grid.copy()
+        solids.apply(painted, flow)
+        rebuilt.apply(fresh, flow)
+        np.testing.assert_array_equal(painted, fresh)
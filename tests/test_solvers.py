@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+from engine import Flow, SolidsHandler, Solver, SolverOptions, residual, solve
+from utils import get_test_scenario
+
+SYSTEMS = {
+    # a, c and flow of the systems of diffuse and project
+    "diffusion": (0.5, 3.0, Flow.VERTICAL),
+    "pressure": (1, 4, Flow.NONE),
+}
+
+
+def jacobi(x, rhs, a, c, boundary, flow, sweeps):
+    """The plain Jacobi iteration of the system of `solve`, the reference of the solvers."""
+    for _ in range(sweeps):
+        neighbours = x[:-2, 1:-1] + x[2:, 1:-1] + x[1:-1, :-2] + x[1:-1, 2:]
+        x[1:-1, 1:-1] = (rhs[1:-1, 1:-1] + a * neighbours) / c
+        boundary.apply(x, flow)
+
+
+def consistent_rhs(boundary, a, c, flow):
+    """Returns the rhs of a known solution, so that the singular pressure system is
+    consistent."""
+    solution = np.random.default_rng(0).standard_normal(boundary.bound.shape)
+    boundary.apply(solution, flow)
+    rhs = np.zeros_like(solution)
+    rhs[1:-1, 1:-1] = -residual(solution, rhs, a, c, boundary)
+    return rhs
+
+
+@pytest.fixture(params=[1, 4, 5], ids=lambda scenario: f"scenario{scenario}")
+def boundary(request):
+    return SolidsHandler(get_test_scenario(request.param, 34, 42)[-1])
+
+
+@pytest.fixture(params=sorted(SYSTEMS))
+def system(request):
+    return request.param
+
+
+@pytest.fixture
+def check_against_jacobi(boundary, system):
+    """Returns a function that solves a system of the boundary with the given options,
+    and checks the result against the Jacobi reference."""
+
+    def check(options: SolverOptions) -> None:
+        a, c, flow = SYSTEMS[system]
+        rhs = consistent_rhs(boundary, a, c, flow)
+
+        x = np.zeros_like(rhs)
+        solve(x, rhs, a, c, boundary, flow, options)
+        # at least as close as the 20 Jacobi sweeps the simulation runs by default
+        reference = np.zeros_like(rhs)
+        jacobi(reference, rhs, a, c, boundary, flow, 20)
+        norm = np.linalg.norm(residual(x, rhs, a, c, boundary))
+        assert norm <= np.linalg.norm(residual(reference, rhs, a, c, boundary))
+        if system == "diffusion":
+            # the diffusion system has a single solution, which Jacobi converges to
+            jacobi(reference, rhs, a, c, boundary, flow, 200)
+            fluid = boundary.mask_neg
+            np.testing.assert_allclose(x[fluid], reference[fluid], atol=1e-6)
+
+    return check
+
+
+def test_multigrid(check_against_jacobi):
+    check_against_jacobi(SolverOptions(Solver.MULTIGRID, tol=1e-8, cycles=50))
+
+
+def test_multigrid_stops_at_tol(boundary):
+    a, c, flow = SYSTEMS["pressure"]
+    rng = np.random.default_rng(0)
+    rhs = rng.standard_normal(boundary.bound.shape)
+    rhs[boundary.mask] = 0
+    rhs -= rhs[boundary.mask_neg].mean() * boundary.mask_neg
+    options = SolverOptions(Solver.MULTIGRID, tol=1e-2, cycles=50)
+    solve(np.zeros_like(rhs), rhs, a, c, boundary, flow, options)
+    assert 1 <= options.iterations < 50
+
+
+def test_conjugate_gradient(check_against_jacobi):
+    check_against_jacobi(SolverOptions(Solver.CG, tol=1e-8, max_iter=1000))
+
+
+def test_conjugate_gradient_stops_at_tol(boundary):
+    a, c, flow = SYSTEMS["diffusion"]
+    rhs = np.random.default_rng(0).standard_normal(boundary.bound.shape)
+    options = SolverOptions(Solver.CG, tol=1e-3, max_iter=1000)
+    x = np.zeros_like(rhs)
+    solve(x, rhs, a, c, boundary, flow, options)
+    assert 1 <= options.iterations < 1000
+    assert np.linalg.norm(residual(x, rhs, a, c, boundary)) <= 1e-3 * np.linalg.norm(
+        rhs[1:-1, 1:-1] * boundary.mask_neg[1:-1, 1:-1]
+    )
+
+
+@pytest.mark.parametrize("system", sorted(SYSTEMS))
+def test_spectral(system):
+    boundary = SolidsHandler(get_test_scenario(1, 34, 42)[-1])
+    assert boundary.box_only
+    a, c, flow = SYSTEMS[system]
+    rhs = consistent_rhs(boundary, a, c, flow)
+    # exact, up to the constant the pure Neumann pressure is only defined by
+    x = np.zeros_like(rhs)
+    solve(x, rhs, a, c, boundary, flow, SolverOptions(spectral=True))
+    assert np.linalg.norm(residual(x, rhs, a, c, boundary)) < 1e-10
+
+
+def test_spectral_falls_back_with_obstacles():
+    boundary = SolidsHandler(get_test_scenario(5, 34, 42)[-1])
+    assert not boundary.box_only
+    options = SolverOptions(Solver.CG, tol=1e-8, max_iter=1000, spectral=True)
+    a, c, flow = SYSTEMS["diffusion"]
+    rhs = np.random.default_rng(0).standard_normal(boundary.bound.shape)
+    solve(np.zeros_like(rhs), rhs, a, c, boundary, flow, options)
+    assert options.iterations > 1
+
+
+@pytest.mark.parametrize("omega", [1.0, 1.8])
+def test_sor(check_against_jacobi, omega):
+    check_against_jacobi(SolverOptions(Solver.SOR, tol=1e-8, max_iter=2000, omega=omega))
+
+
+def test_over_relaxation_converges_faster(boundary):
+    a, c, flow = SYSTEMS["pressure"]
+    rhs = consistent_rhs(boundary, a, c, flow)
+    iterations = []
+    for omega in (1.0, 1.8):
+        options = SolverOptions(Solver.SOR, tol=1e-6, max_iter=5000, omega=omega)
+        solve(np.zeros_like(rhs), rhs, a, c, boundary, flow, options)
+        iterations.append(options.iterations)
+    assert iterations[1] < iterations[0]
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from engine import CFLControl, FluidSimulation
+
+
+def velocities(speed, rows=34, cols=42):
+    """Returns u and v where the fastest cell moves speed cells in a dt of 1."""
+    u, v = np.zeros((rows, cols)), np.zeros((rows, cols))
+    u[rows // 2, cols // 2] = speed / rows
+    return u, v
+
+
+def test_quiet_frame_is_a_single_step():
+    u, v = velocities(0.2)
+    assert CFLControl(cfl=0.5).step_size(u, v, 1.0, 0) == 1.0
+
+
+@pytest.mark.parametrize("speed", [0.0, 0.7, 3.0, 100.0])
+@pytest.mark.parametrize("dt", [0.5, 1.0, 2.0])
+def test_substeps_sum_to_dt(speed, dt):
+    control = CFLControl(cfl=0.5, max_substeps=8)
+    u, v = velocities(speed)
+    sim = FluidSimulation.from_scenario(0, *u.shape, diff=0, visc=0)
+    sim.u, sim.v = u, v
+    steps = list(sim.substeps(dt, control))
+    assert sum(steps) == pytest.approx(dt)
+    assert 1 <= len(steps) <= control.max_substeps
+    if speed * dt / control.cfl <= control.max_substeps:
+        # no substep moves a cell further than cfl cells
+        assert max(steps) * speed <= control.cfl * (1 + 1e-9)
+    else:
+        assert len(steps) == control.max_substeps
+
+
+def test_advance_takes_the_substeps(run):
+    sim = run(steps=0)
+    sim.u[5, 5] = 4.0 / sim.u.shape[0]  # 4 cells per frame
+    # the later substeps are sized by the velocities the earlier ones left
+    assert sim.advance(1.0, CFLControl(cfl=1.0, max_substeps=8)) > 1
+    assert sim.advance(1.0) == 1
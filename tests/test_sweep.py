@@ -0,0 +1,47 @@
+import dataclasses
+import os
+
+import numpy as np
+
+import headless
+import sweep
+
+
+def sweep_args(tmp_path, **simulation):
+    return sweep.Args(
+        diffs=(1e-5, 1e-4), steps=(3,), sample_every=1, processes=1,
+        output_dir=str(tmp_path),
+        simulation=headless.Args(WIDTH=60, HEIGHT=40, **simulation),
+    )
+
+
+def test_finished_configurations_are_skipped(tmp_path, capsys):
+    args = sweep_args(tmp_path)
+    sweep.main(args)
+    index = tmp_path / "index.jsonl"
+    finished = index.read_text()
+    keys = sweep.load_index(str(index))
+    configs = sweep.configurations(args)
+    assert keys == {sweep.config_key(config, args.seed) for config in configs}
+    for key in keys:
+        grid = np.load(os.path.join(tmp_path, key, "grid.npy"), mmap_mode="r")
+        samples = np.load(os.path.join(tmp_path, key, "samples.npy"), mmap_mode="r")
+        assert samples.shape == (3, 3) + grid.shape
+        np.testing.assert_array_equal(samples[-1, 0], grid)
+
+    capsys.readouterr()
+    sweep.main(args)
+    assert "2 of 2 configurations already finished" in capsys.readouterr().out
+    assert index.read_text() == finished
+
+    # any other option makes new configurations
+    sweep.main(sweep_args(tmp_path, dt=0.5))
+    assert len(sweep.load_index(str(index))) == 4
+
+
+def test_key_covers_every_option():
+    config = headless.Args()
+    assert sweep.config_key(config, 0) != sweep.config_key(config, 1)
+    assert sweep.config_key(config, 0) != sweep.config_key(
+        dataclasses.replace(config, cfl=0.5), 0
+    )
@@ -0,0 +1,73 @@
+import time
+
+import numpy as np
+import pytest
+
+from threaded import SimulationThread, SnapshotBuffer
+
+
+def test_snapshot_stays_until_the_next_latest(run):
+    sim = run(steps=0)
+    buffer = SnapshotBuffer()
+    assert buffer.latest() is None
+
+    sim.grid[:] = 1
+    buffer.publish(sim, 1, 1)
+    first = buffer.latest()
+    sim.grid[:] = 2
+    buffer.publish(sim, 2, 1)
+    sim.grid[:] = 3
+    buffer.publish(sim, 3, 1)
+    # the front snapshot is a copy that later publishes do not write into
+    assert first.steps == 1 and (first.grid == 1).all()
+
+    latest = buffer.latest()
+    assert latest.steps == 3 and (latest.grid == 3).all()
+    assert buffer.latest() is latest  # nothing new was published
+
+
+def test_snapshot_follows_a_resolution_change(run):
+    sim = run(steps=0)
+    buffer = SnapshotBuffer()
+    buffer.publish(sim, 1, 1)
+    sim.resample(18, 22)
+    buffer.publish(sim, 2, 1)
+    assert buffer.latest().grid.shape == (18, 22)
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_thread_steps_and_applies_commands(run):
+    sim = run(steps=0)
+    runner = SimulationThread(sim, 1.0, rate=0)
+    runner.start()
+    applied = []
+    try:
+        runner.post(applied.append)
+        wait_for(lambda: runner.latest().steps >= 3)
+    finally:
+        runner.stop()
+    assert applied == [sim]
+    # the last published snapshot is the state the thread stopped at
+    np.testing.assert_array_equal(runner.latest().grid, sim.grid)
+
+
+def test_thread_reraises_its_error(run):
+    runner = SimulationThread(run(steps=0), 1.0, rate=0)
+    runner.start()
+
+    def fail(sim):
+        raise ValueError("command failed")
+
+    runner.post(fail)
+    try:
+        wait_for(lambda: runner.error is not None)
+    finally:
+        runner.stop()
+    with pytest.raises(RuntimeError):
+        runner.latest()
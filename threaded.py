@@ -0,0 +1,148 @@
+"""Runs a FluidSimulation on a background thread, decoupled from the render loop.
+
+The solver thread advances the simulation at a fixed rate and publishes every finished
+step as a snapshot. The render loop only ever reads the latest snapshot, and sends its
+input to the solver thread as commands. Neither side waits for the other, so input
+latency and render smoothness no longer depend on how long a solver step takes.
+NumPy releases the GIL in its loops, so the two threads overlap.
+"""
+
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from engine import CFLControl, FluidSimulation
+
+
+@dataclass
+class Snapshot:
+    """Copies of the fields after a finished step, with the stats of that step."""
+
+    grid: np.ndarray
+    u: np.ndarray
+    v: np.ndarray
+    steps: int = 0
+    substeps: int = 0
+    stage_times: Dict[str, float] = field(default_factory=dict)
+
+
+class SnapshotBuffer:
+    """Double buffer of snapshots, with a spare so that neither side ever waits.
+
+    The writer fills the back snapshot and publishes it by swapping it with the ready
+    one. The reader swaps the ready snapshot to the front when a new one was published
+    and keeps reading the front until the next call. Only the swaps take the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._front: Optional[Snapshot] = None
+        self._ready: Optional[Snapshot] = None
+        self._back: Optional[Snapshot] = None
+        self._fresh = False
+
+    def publish(self, sim: FluidSimulation, steps: int, substeps: int) -> None:
+        """Copies the fields of sim into the back snapshot and makes it the ready one."""
+        back = self._back
+        if (
+            back is None
+            or back.grid.shape != sim.grid.shape
+            or back.grid.dtype != sim.grid.dtype
+        ):
+            # the first snapshots, or the resolution changed
+            back = Snapshot(
+                np.empty_like(sim.grid), np.empty_like(sim.u), np.empty_like(sim.v)
+            )
+        np.copyto(back.grid, sim.grid)
+        np.copyto(back.u, sim.u)
+        np.copyto(back.v, sim.v)
+        back.steps = steps
+        back.substeps = substeps
+        back.stage_times = dict(sim.stage_times)
+
+        with self._lock:
+            self._back, self._ready = self._ready, back
+            self._fresh = True
+
+    def latest(self) -> Optional[Snapshot]:
+        """Returns the latest published snapshot, None before the first one. It stays
+        unchanged until the next call."""
+        with self._lock:
+            if self._fresh:
+                self._front, self._ready = self._ready, self._front
+                self._fresh = False
+            return self._front
+
+
+class SimulationThread:
+    """Advances sim by dt, rate times per second, on a background thread.
+
+    Everything that touches the simulation from the outside, e.g. painting sources or
+    solids, has to be sent with `post` as a function of the simulation. It is applied
+    between two steps by the solver thread, in the order it was posted.
+    """
+
+    def __init__(
+        self,
+        sim: FluidSimulation,
+        dt: float,
+        control: Optional[CFLControl] = None,
+        rate: float = 60.0,
+    ):
+        self.sim = sim
+        self.dt = dt
+        self.control = control
+        self.rate = rate
+        self.snapshots = SnapshotBuffer()
+        self.error: Optional[BaseException] = None
+        # SimpleQueue is lock free for the single producer and consumer used here
+        self._commands: "queue.SimpleQueue[Callable[[FluidSimulation], None]]" = (
+            queue.SimpleQueue()
+        )
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="simulation", daemon=True)
+
+    def start(self) -> None:
+        self.snapshots.publish(self.sim, 0, 0)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def post(self, command: Callable[[FluidSimulation], None]) -> None:
+        """Queues command to be called with the simulation before the next step."""
+        self._commands.put(command)
+
+    def latest(self) -> Snapshot:
+        """Returns the latest snapshot, re-raising the error the solver thread died of."""
+        if self.error is not None:
+            raise RuntimeError("The simulation thread stopped") from self.error
+        return self.snapshots.latest()
+
+    def _run(self) -> None:
+        period = 1 / self.rate if self.rate > 0 else 0.0
+        steps = 0
+        next_step = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                while True:
+                    try:
+                        command = self._commands.get_nowait()
+                    except queue.Empty:
+                        break
+                    command(self.sim)
+
+                substeps = self.sim.advance(self.dt, self.control)
+                steps += 1
+                self.snapshots.publish(self.sim, steps, substeps)
+
+                # fixed simulation rate, a step that ran late is not made up for
+                next_step = max(next_step + period, time.perf_counter())
+                self._stop.wait(next_step - time.perf_counter())
+        except BaseException as e:
+            self.error = e
@@ -71,6 +71,16 @@ def hsl_to_rgb(h, s, l) -> int:
         | unsigned_byte(b * 255)
     )
 
+# packed 0xRRGGBB colors of the densities 0 to 255, in steps of 0.255
+density_lut = np.array([hsl_to_rgb(180, 61, l / 10) for l in range(1001)], dtype=np.uint32)
+
+
+def density_pixels(grid: np.ndarray) -> np.ndarray:
+    """Returns the packed 0xRRGGBB image of the density, one pixel per interior cell."""
+    # keep in mind that the first and last rows and columns are boundaries, so they dont need to be drawn
+    l = (np.clip(grid[1:-1, 1:-1], 0, 255) / 255) * 1000
+    return density_lut[l.astype(np.intp)]  # TODO: consider proper rounding
+
 def int_to_rgb(rgb_int: int) -> tuple[int, int, int]:
     r = (rgb_int >> 16) & 255
     g = (rgb_int >> 8) & 255
@@ -119,21 +129,22 @@ def generate_fractal_noise_2d(shape, res, octaves=1, persistence=0.5):
     return noise
 
 
-def get_test_scenario(scenario_id: int, rows: int, cols: int):
+def get_test_scenario(scenario_id: int, rows: int, cols: int, dtype=np.float64):
+    """dtype is the floating point type of every returned field, e.g. np.float32"""
     if scenario_id == 0:
-        return test_scenario_0(rows, cols)
+        return test_scenario_0(rows, cols, dtype)
     elif scenario_id == 1:
-        return test_scenario_1(rows, cols)
+        return test_scenario_1(rows, cols, dtype)
     elif scenario_id == 2:
-        return test_scenario_2(rows, cols)
+        return test_scenario_2(rows, cols, dtype)
     elif scenario_id == 3:
-        return test_scenario_3(rows, cols)
+        return test_scenario_3(rows, cols, dtype)
     elif scenario_id == 4:
-        return test_scenario_4(rows, cols)
+        return test_scenario_4(rows, cols, dtype)
     elif scenario_id == 5:
-        return test_scenario_5(rows, cols)
+        return test_scenario_5(rows, cols, dtype)
     elif scenario_id == 6:
-        return test_scenario_6(rows, cols)
+        return test_scenario_6(rows, cols, dtype)
     else:
         raise ValueError(
             f"Test scenario {scenario_id} does not exist, available test scenarios: 0, 1, 2, 3, 4, 5"
@@ -141,58 +152,58 @@ def get_test_scenario(scenario_id: int, rows: int, cols: int):
 
 
 def test_scenario_0(
-    rows: int, cols: int
+    rows: int, cols: int, dtype=np.float64
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """Sets up an empty test scenario"""
-    grid = np.zeros(shape=(rows, cols))
+    grid = np.zeros(shape=(rows, cols), dtype=dtype)
     u = np.zeros_like(grid)
     v = np.zeros_like(grid)
     source = np.zeros_like(grid)
-    solids = make_solid_box(source.shape)
+    solids = make_solid_box(source.shape, source.dtype)
     return grid, source, u, v, solids
 
 
 def test_scenario_1(
-    rows: int, cols: int
+    rows: int, cols: int, dtype=np.float64
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """Sets up a test scenario where there is a strip of sources in the middle of the left edge,
     and there is only constant right directed, laminar wind.
 
     :return grid, source, u, v, solids
     """
-    grid = np.zeros(shape=(rows, cols))
+    grid = np.zeros(shape=(rows, cols), dtype=dtype)
     u = np.zeros_like(grid)
     v = np.zeros_like(grid)
     v[:, 1:-2] = 0.001
     source = np.zeros_like(grid)
     source[(rows // 2) - 6 : (rows // 2) + 6, 1] = 150
-    solids = make_solid_box(source.shape)
+    solids = make_solid_box(source.shape, source.dtype)
 
     return grid, source, u, v, solids
 
 
 def test_scenario_2(
-    rows: int, cols: int
+    rows: int, cols: int, dtype=np.float64
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """Sets up a test scenario where there are three dot sources in the middle with no wind.
 
     Returns:
         grid, source, u, v, solids
     """
-    grid = np.zeros(shape=(rows, cols))
+    grid = np.zeros(shape=(rows, cols), dtype=dtype)
     u = np.zeros_like(grid)
     v = np.zeros_like(grid)
     source = np.zeros_like(grid)
     source[2 * rows // 3, cols // 2] = 200
     source[rows // 2, cols // 3] = 200
     source[rows // 2, 2 * cols // 3] = 200
-    solids = make_solid_box(source.shape)
+    solids = make_solid_box(source.shape, source.dtype)
 
     return grid, source, u, v, solids
 
 
 def test_scenario_3(
-    rows: int, cols: int
+    rows: int, cols: int, dtype=np.float64
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """Sets up a test scenario where there is a strip of sources in the middle of the left edge,
     and there is right facing wind with perlin noise.
@@ -200,7 +211,7 @@ def test_scenario_3(
     Returns:
         grid, source, u, v, solids
     """
-    grid = np.zeros(shape=(rows, cols))
+    grid = np.zeros(shape=(rows, cols), dtype=dtype)
     u = np.zeros_like(grid)
     noise = generate_perlin_noise_2d(grid.shape, res=(2, 2))
     v = np.zeros_like(grid)
@@ -208,20 +219,20 @@ def test_scenario_3(
     v += noise / 200
     source = np.zeros_like(grid)
     source[(rows // 2) - 3 : (rows // 2) + 3, 1] = 200
-    solids = make_solid_box(source.shape)
+    solids = make_solid_box(source.shape, source.dtype)
 
     return grid, source, u, v, solids
 
 
 def test_scenario_4(
-    rows: int, cols: int
+    rows: int, cols: int, dtype=np.float64
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """Sets up a test scenario where there is a strip of sources in the middle of the left edge,
     there is only constant right directed, laminar wind and a solid wall in the middle.
 
     :return grid, source, u, v, solids
     """
-    grid, source, u, v, solids = test_scenario_1(rows, cols)
+    grid, source, u, v, solids = test_scenario_1(rows, cols, dtype)
     r3 = int(rows / 3)
     c3 = int(cols / 3)
     solids[0:r3, c3 : c3 + 5] = 1
@@ -231,14 +242,14 @@ def test_scenario_4(
 
 
 def test_scenario_5(
-    rows: int, cols: int
+    rows: int, cols: int, dtype=np.float64
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """Sets up a test scenario where there is a strip of sources in the middle of the left edge,
     there is only constant right directed, laminar wind and a solid disk in the middle.
 
     :return grid, source, u, v, solids
     """
-    grid, source, u, v, solids = test_scenario_1(rows, cols)
+    grid, source, u, v, solids = test_scenario_1(rows, cols, dtype)
     r2 = int(rows / 2)
     c2 = int(cols / 2)
     R = 2
@@ -250,7 +261,7 @@ def test_scenario_5(
 
 
 def test_scenario_6(
-    rows: int, cols: int
+    rows: int, cols: int, dtype=np.float64
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """Sets up a test scenario where there is a strip of sources in the middle of the left edge,
     and there is right facing wind with fractal noise.
@@ -258,7 +269,7 @@ def test_scenario_6(
     Returns:
         grid, source, u, v, solids
     """
-    grid = np.zeros(shape=(rows, cols))
+    grid = np.zeros(shape=(rows, cols), dtype=dtype)
     u = np.zeros_like(grid)
     noise = generate_fractal_noise_2d(grid.shape, res=(2, 2))
     v = np.zeros_like(grid)
@@ -266,13 +277,13 @@ def test_scenario_6(
     v += noise / 200
     source = np.zeros_like(grid)
     source[(rows // 2) - 3 : (rows // 2) + 3, 1] = 200
-    solids = make_solid_box(source.shape)
+    solids = make_solid_box(source.shape, source.dtype)
 
     return grid, source, u, v, solids
 
 
-def make_solid_box(shape: Tuple[int, int]) -> np.ndarray:
-    box = np.zeros(shape)
+def make_solid_box(shape: Tuple[int, int], dtype=np.float64) -> np.ndarray:
+    box = np.zeros(shape, dtype=dtype)
     box[0, :] = 1
     box[-1, :] = 1
     box[:, 0] = 1